@@ -0,0 +1,102 @@
+"""Tests for the yadlt.utils.inference package."""
+
+import numpy as np
+import os
+import subprocess
+from scipy import sparse
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+import yadlt.utils.inference as inference
+
+
+class TestInferenceMethods(unittest.TestCase):
+    """Test the numpy inference of dense networks."""
+
+    def setUp(self):
+        """Setup values for testing."""
+        rng = np.random.RandomState(0)
+        self.x = rng.rand(39, 58).astype(np.float32)
+        self.weights = [rng.randn(58, 20), rng.randn(20, 5)]
+        self.biases = [rng.randn(20), rng.randn(5)]
+        self.activations = ['sigmoid', 'linear']
+
+    def _float_forward(self):
+        h = 1. / (1. + np.exp(-(self.x.dot(self.weights[0]) +
+                                self.biases[0])))
+        return h.dot(self.weights[1]) + self.biases[1]
+
+    def test_quantize_per_channel(self):
+        """Test that the quantization error is within half a step."""
+        q, scales = inference.quantize_per_channel(self.weights[0])
+
+        self.assertEqual(q.dtype, np.int8)
+        self.assertEqual(scales.shape, (20,))
+        err = np.abs(q * scales - self.weights[0])
+        self.assertTrue(np.all(err <= scales / 2 + 1e-6))
+
+    def test_dense_forward(self):
+        """Test the float forward pass in batches and with sparse input."""
+        network = inference.DenseNetwork(
+            self.weights, self.biases, self.activations)
+        out = network.forward(self.x, batch_size=10)
+
+        np.testing.assert_allclose(out, self._float_forward(), rtol=1e-5)
+        np.testing.assert_allclose(
+            network.forward(sparse.csr_matrix(self.x)), out, rtol=1e-5)
+
+    def test_import_without_tensorflow(self):
+        """Test that the inference module does not import tensorflow."""
+        code = ('import sys, yadlt.utils.inference; '
+                'sys.exit("tensorflow" in sys.modules)')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+    def test_quantized_forward(self):
+        """Test the quantized forward pass against the float one."""
+        network = inference.QuantizedNetwork.from_float(
+            self.weights, self.biases, self.activations)
+        out = network.forward(self.x, batch_size=10)
+
+        np.testing.assert_allclose(out, self._float_forward(), atol=0.1)
+        np.testing.assert_allclose(
+            network.forward(sparse.csr_matrix(self.x)), out, rtol=1e-5)
+
+    def test_quantized_forward_memory(self):
+        """Test that the forward pass never holds float32 weight matrices."""
+        rng = np.random.RandomState(0)
+        weights = [rng.randn(1024, 1024)]
+        network = inference.QuantizedNetwork.from_float(
+            weights, [np.zeros(1024)], ['relu'])
+        x = rng.rand(8, 1024).astype(np.float32)
+
+        tracemalloc.start()
+        try:
+            network.forward(x)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 1024 * 1024 * 4 // 2)
+        self.assertLess(network.nbytes, 1024 * 1024 * 4 // 3)
+
+    def test_save_load(self):
+        """Test that saved networks predict the same output."""
+        path = os.path.join(tempfile.mkdtemp(), 'network.npz')
+
+        for network in [
+                inference.DenseNetwork(
+                    self.weights, self.biases, self.activations),
+                inference.QuantizedNetwork.from_float(
+                    self.weights, self.biases, self.activations)]:
+            network.save(path)
+            loaded = type(network).load(path)
+
+            self.assertEqual(loaded.activations, self.activations)
+            np.testing.assert_array_equal(
+                loaded.forward(self.x), network.forward(self.x))
+
+
+if __name__ == '__main__':
+    unittest.main()
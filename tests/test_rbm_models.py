@@ -0,0 +1,62 @@
+"""Tests for the yadlt.models.rbm_models package."""
+
+import numpy as np
+import tensorflow as tf
+import unittest
+
+from yadlt.models.rbm_models import rbm
+
+
+@unittest.skipUnless(hasattr(tf, 'pack'), 'requires the TensorFlow 0.12 API')
+class TestRBMModels(unittest.TestCase):
+    """Test the rbm based models."""
+
+    def setUp(self):
+        """Setup values for testing."""
+        self.x = np.random.RandomState(0).randn(50, 8).astype(np.float32)
+
+    def test_gauss_graph(self):
+        """Test that a gaussian rbm hands off float32 sigma-scaled weights."""
+        machine = rbm.RBM(num_hidden=4, name='test-rbm-gauss', batch_size=10,
+                          visible_unit_type='gauss', stddev=0.1)
+        with tf.Graph().as_default() as graph:
+            machine.build_model(8)
+            self.assertEqual(machine.log_sigma.dtype.base_dtype, tf.float32)
+            self.assertEqual(machine.w_upd8.dtype.base_dtype, tf.float32)
+
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                machine.tf_inference_session = sess
+                machine.tf_inference_graph = graph
+                W = sess.run(machine.W)
+                encoded = sess.run(machine.encode,
+                                   {machine.input_data: self.x})
+                W_enc, b_enc = machine.get_encoding_parameters(graph=graph)
+                empty = machine.transform(self.x[:0], graph=graph,
+                                          batch_size=10)
+
+        self.assertEqual(empty.shape, (0, 4))
+        self.assertEqual(W_enc.dtype, np.float32)
+        np.testing.assert_allclose(W_enc, W / 0.1, rtol=1e-5)
+        stacked = 1. / (1. + np.exp(-(self.x.dot(W_enc) + b_enc)))
+        np.testing.assert_allclose(stacked, encoded, rtol=1e-4, atol=1e-5)
+
+    def test_float16_graph(self):
+        """Test that a float16 rbm has float32 master parameters."""
+        machine = rbm.RBM(num_hidden=4, name='test-rbm-fp16', batch_size=10,
+                          dtype=tf.float16)
+        with tf.Graph().as_default():
+            machine.build_model(8)
+
+        for var, cast in [(machine.W, machine._W), (machine.bh_, machine._bh),
+                          (machine.bv_, machine._bv)]:
+            self.assertEqual(var.dtype.base_dtype, tf.float32)
+            self.assertEqual(cast.dtype, tf.float16)
+        for upd8 in [machine.w_upd8, machine.bh_upd8, machine.bv_upd8]:
+            self.assertEqual(upd8.dtype.base_dtype, tf.float32)
+        self.assertEqual(machine.encode.dtype, tf.float16)
+        self.assertEqual(machine.cost.dtype, tf.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
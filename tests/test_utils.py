@@ -1,6 +1,7 @@
 """Tests for the yadlt.utils.utilities package."""
 
 import numpy as np
+from scipy import sparse
 import unittest
 
 import yadlt.utils.utilities as utils
@@ -21,6 +22,27 @@ class TestUtilsMethods(unittest.TestCase):
         for sample in x_noise:
             self.assertEqual(sum([i == 0 for i in sample]), self.v)
 
+    def test_masking_noise_in_place(self):
+        """Test masking noise applied in-place with a given rng."""
+        x_mask = utils.masking_noise(
+            self.x, self.v, rng=np.random.RandomState(0))
+        x_out = self.x.copy()
+        utils.masking_noise(
+            x_out, self.v, rng=np.random.RandomState(0), out=x_out)
+
+        np.testing.assert_array_equal(x_mask, x_out)
+
+    def test_masking_noise_sparse(self):
+        """Test that masking noise of a csr matrix only drops elements."""
+        x = sparse.random(39, 58, density=0.5, format='csr', random_state=0)
+        x_mask = utils.masking_noise(x, 29, rng=np.random.RandomState(0))
+
+        self.assertTrue(sparse.isspmatrix_csr(x_mask))
+        self.assertLess(x_mask.nnz, x.nnz)
+        x_dense, x_mask_dense = x.toarray(), x_mask.toarray()
+        kept = x_mask_dense != 0
+        np.testing.assert_array_equal(x_mask_dense[kept], x_dense[kept])
+
     def test_salt_and_pepper_noise_with_min_max(self):
         """Test the salt and pepper function with given min and max."""
         x_sp = utils.salt_and_pepper_noise(self.x, self.v, 0, 1)
@@ -40,6 +62,86 @@ class TestUtilsMethods(unittest.TestCase):
             salted_elements = sum([i == mn or i == mx for i in sample])
             self.assertAlmostEqual(salted_elements, self.v, delta=2)
 
+    def test_salt_and_pepper_noise_rng_and_out(self):
+        """Test the salt and pepper function with a given rng and out."""
+        x_sp = utils.salt_and_pepper_noise(
+            self.x, self.v, rng=np.random.RandomState(0))
+        x_out = self.x.copy()
+        x_res = utils.salt_and_pepper_noise(
+            x_out, self.v, rng=np.random.RandomState(0), out=x_out)
+
+        self.assertIs(x_res, x_out)
+        np.testing.assert_array_equal(x_sp, x_out)
+        salted = (x_sp == self.x.min()) | (x_sp == self.x.max())
+        self.assertTrue(np.all(salted.sum(axis=1) >= self.v))
+
+    def test_conv2bin(self):
+        """Test conversion of probabilities into binary values."""
+        x_bin = utils.conv2bin(self.x, dtype=np.uint8)
+
+        self.assertEqual(x_bin.dtype, np.uint8)
+        self.assertEqual(x_bin.shape, self.x.shape)
+        self.assertTrue(np.all((x_bin == 0) | (x_bin == 1)))
+
+    def test_normalize(self):
+        """Test that normalized samples sum to one."""
+        x_norm = utils.normalize(self.x)
+
+        np.testing.assert_allclose(x_norm.sum(axis=1), 1.)
+        np.testing.assert_allclose(
+            x_norm, self.x / self.x.sum(axis=1)[:, None])
+
+    def test_gen_minibatches(self):
+        """Test that minibatches cover the aligned rows exactly once."""
+        y = np.arange(self.x.shape[0])
+        seen = []
+
+        for x_batch, y_batch in utils.gen_minibatches([self.x, y], 10):
+            self.assertEqual(x_batch.dtype, np.float32)
+            self.assertLessEqual(x_batch.shape[0], 10)
+            rows = y_batch.astype(np.int64)
+            np.testing.assert_allclose(x_batch, self.x[rows], rtol=1e-6)
+            seen.extend(rows)
+
+        self.assertEqual(sorted(seen), list(y))
+
+    def test_gen_minibatches_no_shuffle(self):
+        """Test that float64 batches are converted without shuffling."""
+        batches = list(utils.gen_minibatches([self.x], 10, shuffle=False))
+
+        for (x_batch,) in batches:
+            self.assertEqual(x_batch.dtype, np.float32)
+        np.testing.assert_allclose(
+            np.vstack([b[0] for b in batches]), self.x, rtol=1e-6)
+
+    def test_gen_minibatches_sparse(self):
+        """Test that csr matrices are batched as csr matrices."""
+        x = sparse.random(39, 58, density=0.1, format='csr', random_state=0)
+        y = np.arange(x.shape[0])
+
+        for x_batch, y_batch in utils.gen_minibatches([x, y], 10):
+            self.assertTrue(sparse.isspmatrix_csr(x_batch))
+            self.assertEqual(x_batch.dtype, np.float32)
+            rows = y_batch.astype(np.int64)
+            np.testing.assert_allclose(
+                x_batch.toarray(), x[rows].toarray(), rtol=1e-6)
+
+    def test_rbm_ais_log_partition(self):
+        """Test the AIS estimate against the exact log Z of a small rbm."""
+        rng = np.random.RandomState(0)
+        W = rng.randn(8, 4)
+        bh, bv = rng.randn(4), rng.randn(8)
+
+        states = ((np.arange(2 ** 8)[:, None] >> np.arange(8)) & 1)
+        log_z = np.logaddexp.reduce(
+            -utils.rbm_free_energy(states.astype(np.float64), W, bh, bv))
+
+        log_z_ais, log_w = utils.rbm_ais_log_partition(
+            W, bh, bv, num_betas=1000, num_chains=200, rng=rng)
+
+        self.assertEqual(log_w.shape, (200,))
+        self.assertAlmostEqual(log_z_ais, log_z, delta=0.1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,8 @@ import abc
 import six
 import tensorflow as tf
 
+from yadlt.utils import tfutils
+
 
 @six.add_metaclass(abc.ABCMeta)
 class BaseLayer(object):
@@ -35,20 +37,29 @@ class BaseLayer(object):
 class Linear(BaseLayer):
     """Fully-Connected layer."""
 
-    def __init__(self, shape, name="linear", vnames=["W", "b"]):
-        """Create a new linear layer instance."""
+    def __init__(self, shape, name="linear", vnames=["W", "b"],
+                 dtype=tf.float32):
+        """Create a new linear layer instance.
+
+        The variables are float32 master copies cast to dtype in forward,
+        float16 products are accumulated in float32.
+        """
         self.name = name
         self.vnames = vnames
+        self.dtype = dtype
         with tf.name_scope(self.name):
             self.W = tf.Variable(
-                tf.truncated_normal(shape=shape, stddev=0.1), name=vnames[0])
+                tf.truncated_normal(shape=shape, stddev=0.1),
+                name=vnames[0])
             self.b = tf.Variable(
                 tf.constant(0.1, shape=[shape[1]]), name=vnames[1])
 
     def forward(self, X):
-        """Forward propagate X through the fc layer."""
+        """Forward propagate X, dense or tf.SparseTensor, through the layer."""
         with tf.name_scope(self.name):
-            return tf.add(tf.matmul(X, self.W), self.b)
+            return tf.add(
+                tfutils.input_matmul(X, tf.cast(self.W, self.dtype)),
+                tf.cast(self.b, self.dtype))
 
     def backward(self, H):
         """Backward propagate H through the fc layer."""
@@ -98,23 +109,34 @@ class Activation(BaseLayer):
 class SoftMax(BaseLayer):
     """SoftMax layer."""
 
-    def __init__(self, prev_layer, n_classes, name="softmax"):
-        """Create a new SoftMax layer instance."""
+    def __init__(self, prev_layer, n_classes, name="softmax", dtype=None):
+        """Create a new SoftMax layer instance.
+
+        dtype defaults to the type of prev_layer, the variables are float32
+        master copies cast to dtype in forward.
+        """
         self.prev_layer = prev_layer
         self.shape = (prev_layer.get_shape()[1].value, n_classes)
         self.n_classes = n_classes
         self.name = name
         self.vs = ['softmax_W', 'softmax_b']
+        if dtype is None:
+            dtype = prev_layer.dtype.base_dtype
+        self.dtype = dtype
         with tf.name_scope(self.name):
             self.W = tf.Variable(
-                tf.truncated_normal(self.shape, stddev=0.1), name=self.vs[0])
+                tf.truncated_normal(self.shape, stddev=0.1),
+                name=self.vs[0])
             self.b = tf.Variable(
                 tf.constant(0.1, shape=[n_classes]), name=self.vs[0])
 
     def forward(self, X):
         """Forward propagate X."""
         with tf.name_scope(self.name):
-            return tf.add(tf.matmul(self.prev_layer, self.W), self.b)
+            return tf.add(
+                tfutils.matmul_acc(tf.cast(self.prev_layer, self.dtype),
+                                   tf.cast(self.W, self.dtype)),
+                tf.cast(self.b, self.dtype))
 
     def backward(self, H):
         """Backward propagate H through the fc layer."""
@@ -133,6 +155,58 @@ class SoftMax(BaseLayer):
             }
 
 
+class Corruption(BaseLayer):
+    """Input corruption layer.
+
+    Each element of the input is corrupted independently with probability
+    corr_frac, so the noise is drawn in-graph for every batch.
+    """
+
+    def __init__(self, corr_type, corr_frac, mn=None, mx=None,
+                 name="corruption"):
+        """Create a new Corruption layer instance.
+
+        corr_type is one of ["none", "masking", "salt_and_pepper"]. The
+        salt and pepper values default to the min (max) of the input batch.
+        """
+        assert corr_type in ["none", "masking", "salt_and_pepper"]
+
+        self.corr_type = corr_type
+        self.corr_frac = corr_frac
+        self.mn = mn
+        self.mx = mx
+        self.name = name
+
+    def forward(self, X):
+        """Forward propagate X."""
+        if self.corr_type == "none" or self.corr_frac <= 0.:
+            return X
+
+        with tf.name_scope(self.name):
+            corrupt = tf.less(tf.random_uniform(tf.shape(X)), self.corr_frac)
+
+            if self.corr_type == "masking":
+                return tf.select(corrupt, tf.zeros_like(X), X)
+
+            mn = tf.reduce_min(X) if self.mn is None else self.mn
+            mx = tf.reduce_max(X) if self.mx is None else self.mx
+            salt = tf.less(tf.random_uniform(tf.shape(X)), 0.5)
+            noise = tf.select(salt, tf.ones_like(X) * mn, tf.ones_like(X) * mx)
+            return tf.select(corrupt, noise, X)
+
+    def backward(self, H):
+        """Backward propagate H through the fc layer."""
+        pass
+
+    def get_variables(self):
+        """Return the layer's variables."""
+        pass
+
+    def get_parameters(self):
+        """Return all the parameters of this layer."""
+        pass
+
+
 class Regularization(BaseLayer):
     """Regularization function layer."""
 
@@ -149,6 +223,8 @@ class Regularization(BaseLayer):
         """Forward propagate X."""
         regs = tf.constant(0.0)
         for v in self.variables:
+            # accumulated in float32 for any variable type
+            v = tf.cast(v, tf.float32)
             if self.regtype == "l1":
                 regs = tf.add(regs, tf.reduce_sum(tf.abs(v)))
 
@@ -179,8 +255,9 @@ class Loss(BaseLayer):
         assert loss_type in ["cross_entropy", "softmax_cross_entropy",
                              "mean_squared"]
 
-        self.mod_y = mod_y
-        self.ref_y = ref_y
+        # the loss is computed in float32 for any model type
+        self.mod_y = tf.cast(mod_y, tf.float32)
+        self.ref_y = tf.cast(ref_y, tf.float32)
         self.loss_type = loss_type
         self.regterm = regterm
         self.name = name
@@ -5,12 +5,19 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import contextlib
+import numpy as np
 import os
+from scipy import sparse
 import six
+import sys
 import tensorflow as tf
+import threading
 
 from .config import Config
-from .layers import BaseLayer
+from .layers import BaseLayer, Loss, Regularization
+from .trainers import train_epochs
+from yadlt.utils import inference
 from yadlt.utils import tfutils
 
 
@@ -91,6 +98,16 @@ class Sequential(NNContainer):
             self.size = 0
         self.name = name
 
+        # if True, the training data is stored in-graph, see `InGraphData`
+        self.in_graph_data = False
+        self.data_pipeline = None
+
+        # True if the model is fitted to scipy sparse (CSR) input
+        self.sparse_input = False
+
+        # type of the input placeholders and of the forward pass
+        self.dtype = tf.float32
+
         # tensorflow objects
         self.tf_graph = tf.Graph()
         self.tf_session = None
@@ -174,13 +191,23 @@ class Sequential(NNContainer):
         -------
         self : trained model instance
         """
+        self.sparse_input = sparse.issparse(train_set)
+        if self.sparse_input and self.in_graph_data:
+            raise Exception('in_graph_data does not support sparse input')
+
         with self.tf_graph.as_default():
+            self.data_pipeline = None
+            if self.in_graph_data:
+                self.data_pipeline = tfutils.InGraphData(
+                    [train_set], self.train_params["batch_size"])
             # Build the model
             self.build_model(train_set.shape[1])
             with tf.Session() as self.tf_session:
                 # Tensorflow initialization
                 summary_objs = tfutils.init_tf_ops(self.tf_session)
                 self.tf_merged_summaries, self.tf_summary_writer = summary_objs
+                if self.data_pipeline is not None:
+                    self.data_pipeline.initialize(self.tf_session)
                 # Train the model
                 for i in range(self.train_params["num_epochs"]):
                     self._run_train_step(train_set)
@@ -202,6 +229,49 @@ class Sequential(NNContainer):
         pass
 
 
+class _EncodingSnapshots(object):
+    """Latest encodings published by a layer during pipelined pretraining."""
+
+    def __init__(self):
+        """Constructor."""
+        self._cond = threading.Condition()
+        self._encodings = None
+        self._final = False
+        self._failed = False
+
+    def publish(self, train, valid, final=False):
+        """Replace the encodings seen by the next layer.
+
+        :param train: encoded training set
+        :param valid: encoded validation set, or None
+        :param final: whether the encodings come from the trained layer
+        """
+        with self._cond:
+            self._encodings = (train, valid)
+            self._final = final
+            self._cond.notify_all()
+
+    def fail(self):
+        """Wake up the next layer, the encodings will never be final."""
+        with self._cond:
+            self._failed = True
+            self._cond.notify_all()
+
+    def latest(self, final=False):
+        """Wait for the latest encodings.
+
+        :param final: if True, wait for the encodings of the trained layer
+        :return: encoded training set, encoded validation set
+        """
+        with self._cond:
+            while not self._failed and (
+                    self._encodings is None or (final and not self._final)):
+                self._cond.wait()
+            if self._failed:
+                raise Exception('The previous layer failed to pretrain.')
+            return self._encodings
+
+
 class Model(object):
     """Class representing an abstract Model."""
 
@@ -223,6 +293,30 @@ class Model(object):
         self.cost = None
         self.verbose = 0
 
+        # cost function and regularization, set by the subclasses
+        self.loss_func = None
+        self.regtype = 'none'
+        self.l2reg = 5e-4
+
+        # if True, the training data is stored in-graph, see `InGraphData`
+        self.in_graph_data = False
+        self.data_pipeline = None
+
+        # True if the model is fitted to scipy sparse (CSR) input
+        self.sparse_input = False
+
+        # type of the input placeholders and of the forward pass
+        self.dtype = tf.float32
+
+        # training hooks used by pipelined pretraining, see `_train_epochs`
+        self.epoch_data_func = None
+        self.epoch_end_hook = None
+        self.epoch_validation_func = None
+
+        # True if the model was fitted without saving it to disk, then its
+        # parameters only live in the inference session
+        self.unsaved = False
+
         # tensorflow objects
         self.tf_graph = tf.Graph()
         self.tf_session = None
@@ -230,56 +324,452 @@ class Model(object):
         self.tf_merged_summaries = None
         self.tf_summary_writer = None
         self.tf_summary_writer_available = True
+        self.tf_inference_session = None
+        self.tf_inference_graph = None
+
+    def __enter__(self):
+        """Enter inference mode, see `open_session`."""
+        return self.open_session()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Leave inference mode, see `close_session`."""
+        self.close_session()
+
+    def open_session(self, graph=None):
+        """Restore the model once and keep it in memory for inference.
+
+        Until `close_session` is called, the inference methods called with
+        the same `graph` reuse this session instead of restoring the model
+        from disk at every call.
+        :param graph: tf graph object the model was built in
+        :return: self
+        """
+        g = graph if graph is not None else self.tf_graph
+
+        if self.tf_inference_session is not None:
+            if self.tf_inference_graph is g:
+                return self
+            self.close_session()
+
+        self._check_saved()
+        sess = tf.Session(graph=g)
+        self.tf_saver.restore(sess, self.model_path)
+        self.tf_inference_session = sess
+        self.tf_inference_graph = g
+        return self
+
+    def close_session(self):
+        """Close the inference session opened with `open_session`.
+
+        :return: self
+        """
+        if self.tf_inference_session is not None:
+            self.tf_inference_session.close()
+            self.tf_inference_session = None
+            self.tf_inference_graph = None
+        return self
+
+    @contextlib.contextmanager
+    def _restored_session(self, graph=None):
+        """Yield a session holding the trained model.
+
+        The inference session is used if it is open on `graph`, otherwise a
+        temporary session is created and the model is restored into it.
+        :param graph: tf graph object the model was built in
+        """
+        g = graph if graph is not None else self.tf_graph
+
+        if self.tf_inference_session is not None and \
+                self.tf_inference_graph is g:
+            yield self.tf_inference_session
+        else:
+            self._check_saved()
+            with tf.Session(graph=g) as sess:
+                self.tf_saver.restore(sess, self.model_path)
+                yield sess
+
+    def _check_saved(self):
+        """Raise an exception if the fitted model is not on disk."""
+        if self.unsaved:
+            raise Exception(
+                'The model was fitted with save=False and its session is '
+                'closed, the trained parameters cannot be restored')
 
     def pretrain_procedure(self, layer_objs, layer_graphs, set_params_func,
-                           train_set, validation_set=None):
+                           train_set, validation_set=None, save_layers=True,
+                           memmap_encodings=False, encode_batch_size=1000,
+                           pipelined=False):
         """Perform unsupervised pretraining of the model.
 
+        The weights and the encoded data are passed from each layer to the
+        next one in memory, the checkpoints of the layers are optional.
+        memmap_encodings and pipelined are supported only for stacks of
+        rbms, they use the batched `encode` node and the per-epoch hooks of
+        `rbm.RBM`, which the denoising autoencoder layers do not have.
         :param layer_objs: list of model objects (autoencoders or rbms)
         :param layer_graphs: list of model tf.Graph objects
         :param set_params_func: function used to set the parameters after
             pretraining
         :param train_set: training set
         :param validation_set: validation set
+        :param save_layers: whether to save each pretrained layer to disk.
+            If False, the training session of each layer is kept open as
+            its inference session, see `open_session`, because it holds
+            the only copy of the layer parameters. optional, default True
+        :param memmap_encodings: if True, the data encoded by each layer is
+            written in chunks to a memory-mapped .npy file in
+            `Config().data_dir` and the next layer is trained from that
+            file, so the encoded datasets are never held in memory.
+            optional, default False
+        :param encode_batch_size: number of rows encoded at a time when
+            memmap_encodings or pipelined is True. optional, default 1000
+        :param pipelined: if True, all the layers are trained at the same
+            time in separate threads, see `_pipelined_pretrain`.
+            optional, default False
         :return: return data encoded by the last layer
         """
+        if pipelined:
+            if memmap_encodings:
+                raise Exception(
+                    'memmap_encodings is not supported by pipelined '
+                    'pretraining')
+            return self._pipelined_pretrain(
+                layer_objs, layer_graphs, set_params_func, train_set,
+                validation_set, save_layers, encode_batch_size)
+
         next_train = train_set
         next_valid = validation_set
+        prev_paths = []
 
         for l, layer_obj in enumerate(layer_objs):
             print('Training layer {}...'.format(l + 1))
+
+            paths = None
+            if memmap_encodings:
+                prefix = os.path.join(
+                    Config().data_dir, '{}-layer-{}'.format(self.name, l + 1))
+                paths = (prefix + '-train.npy', prefix + '-valid.npy')
+
             next_train, next_valid = self._pretrain_layer_and_gen_feed(
                 layer_obj, set_params_func, next_train, next_valid,
-                layer_graphs[l])
+                layer_graphs[l], save_layers, paths, encode_batch_size)
+
+            # the encodings of the previous layer are not needed anymore
+            for path in prev_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            prev_paths = paths or []
 
         return next_train, next_valid
 
+    def _pipelined_pretrain(self, layer_objs, layer_graphs, set_params_func,
+                            train_set, validation_set, save_layers=True,
+                            encode_batch_size=1000):
+        """Pretrain all the layers at the same time, one thread per layer.
+
+        At the end of each epoch a layer publishes the encodings of its
+        current training input. The next layer starts training as soon as
+        the first encodings are available and at each epoch it trains on
+        the latest ones, while the layer below keeps training. The last
+        epoch of each layer waits for the encodings of the trained layer
+        below, so that the returned encodings are computed by the final
+        parameters of all the layers.
+        :param layer_objs: list of model objects (autoencoders or rbms)
+        :param layer_graphs: list of model tf.Graph objects
+        :param set_params_func: function used to set the parameters after
+            pretraining
+        :param train_set: training set
+        :param validation_set: validation set
+        :param save_layers: whether to save each pretrained layer to disk
+        :param encode_batch_size: number of rows encoded at a time
+        :return: return data encoded by the last layer
+        """
+        for layer_obj in layer_objs:
+            if layer_obj.in_graph_data:
+                raise Exception(
+                    'in_graph_data layers cannot be pretrained pipelined, '
+                    'their training set is fixed when the graph is built')
+
+        snapshots = [_EncodingSnapshots() for _ in layer_objs]
+        errors = []
+
+        def run_layer(l):
+            layer_obj = layer_objs[l]
+            if l == 0:
+                def get_input(final):
+                    return train_set, validation_set
+            else:
+                get_input = snapshots[l - 1].latest
+
+            try:
+                current = list(get_input(False))
+                last_epoch = layer_obj.num_epochs - 1
+                print('Training layer {}...'.format(l + 1))
+
+                def epoch_data_func(epoch):
+                    current[:] = get_input(epoch == last_epoch)
+                    return [current[0]]
+
+                def epoch_validation_func(epoch):
+                    # encodings of the same snapshot as the training data
+                    return current[1]
+
+                def epoch_end_hook(epoch):
+                    if epoch < last_epoch:
+                        snapshots[l].publish(*self._encode_in_session(
+                            layer_obj, current, encode_batch_size))
+
+                layer_obj.epoch_data_func = epoch_data_func
+                layer_obj.epoch_validation_func = epoch_validation_func
+                layer_obj.epoch_end_hook = epoch_end_hook
+                layer_obj.fit(current[0], current[0], current[1], current[1],
+                              graph=layer_graphs[l], save=save_layers,
+                              keep_session=True)
+
+                snapshots[l].publish(*self._encode_in_session(
+                    layer_obj, current, encode_batch_size), final=True)
+            except Exception:
+                errors.append(sys.exc_info())
+                snapshots[l].fail()
+            finally:
+                layer_obj.epoch_data_func = None
+                layer_obj.epoch_validation_func = None
+                layer_obj.epoch_end_hook = None
+
+        threads = [threading.Thread(target=run_layer, args=(l,))
+                   for l in range(len(layer_objs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        try:
+            if errors:
+                six.reraise(*errors[0])
+            for l, layer_obj in enumerate(layer_objs):
+                with layer_graphs[l].as_default():
+                    set_params_func(layer_obj, layer_graphs[l])
+        except Exception:
+            for layer_obj in layer_objs:
+                layer_obj.close_session()
+            raise
+
+        if save_layers:
+            for layer_obj in layer_objs:
+                layer_obj.close_session()
+
+        return snapshots[-1].latest(final=True)
+
+    @staticmethod
+    def _encode_in_session(layer_obj, data_sets, batch_size=1000):
+        """Encode data with the training session of a layer.
+
+        :param layer_obj: layer model, while it is trained
+        :param data_sets: list of data to encode, None items are skipped
+        :param batch_size: number of rows encoded at a time
+        :return: list of encoded data
+        """
+        encoded = []
+        for data in data_sets:
+            if data is None:
+                encoded.append(None)
+                continue
+            batches = (layer_obj.tf_session.run(
+                layer_obj.encode,
+                {layer_obj.input_data:
+                    tfutils.feed_value(data[i:i + batch_size]),
+                 layer_obj.keep_prob: 1})
+                for i in range(0, data.shape[0], batch_size))
+            encoded.append(Model._fill_from_batches(
+                batches, data.shape[0], node=layer_obj.encode))
+        return encoded
+
     def _pretrain_layer_and_gen_feed(self, layer_obj, set_params_func,
-                                     train_set, validation_set, graph):
+                                     train_set, validation_set, graph,
+                                     save_layer=True, out_paths=None,
+                                     encode_batch_size=1000):
         """Pretrain a single autoencoder and encode the data for the next layer.
 
+        The training session of the layer is kept open to read its
+        parameters and encode the data, instead of restoring it from disk.
         :param layer_obj: layer model
         :param set_params_func: function used to set the parameters after
             pretraining
         :param train_set: training set
         :param validation_set: validation set
         :param graph: tf object for the rbm
+        :param save_layer: whether to save the layer to disk. If False, the
+            training session is kept open as the inference session
+        :param out_paths: optional, tuple(train path, validation path) of the
+            .npy files the encoded data is written to. If None, the encoded
+            data is kept in memory
+        :param encode_batch_size: number of rows encoded at a time when
+            out_paths is not None
         :return: encoded train data, encoded validation data
         """
         layer_obj.fit(train_set, train_set,
-                      validation_set, validation_set, graph=graph)
-
-        with graph.as_default():
-            set_params_func(layer_obj, graph)
+                      validation_set, validation_set, graph=graph,
+                      save=save_layer, keep_session=True)
 
-            next_train = layer_obj.transform(train_set, graph=graph)
-            if validation_set is not None:
-                next_valid = layer_obj.transform(validation_set, graph=graph)
-            else:
-                next_valid = None
+        try:
+            with graph.as_default():
+                set_params_func(layer_obj, graph)
+
+                next_train = self._encode_layer_input(
+                    layer_obj, train_set, graph,
+                    out_paths and out_paths[0], encode_batch_size)
+                if validation_set is not None:
+                    next_valid = self._encode_layer_input(
+                        layer_obj, validation_set, graph,
+                        out_paths and out_paths[1], encode_batch_size)
+                else:
+                    next_valid = None
+        except Exception:
+            layer_obj.close_session()
+            raise
+
+        if save_layer:
+            layer_obj.close_session()
 
         return next_train, next_valid
 
+    @staticmethod
+    def _encode_layer_input(layer_obj, data, graph, out_path=None,
+                            batch_size=1000):
+        """Encode data with a pretrained layer.
+
+        :param layer_obj: layer model
+        :param data: data to encode
+        :param graph: tf graph object of the layer
+        :param out_path: optional, path of a .npy file the encoded data is
+            written to in chunks of batch_size rows. If None, the encoded
+            data is returned as an in-memory array
+        :param batch_size: number of rows encoded at a time
+        :return: encoded data, memory-mapped read-only if out_path is given
+        """
+        if out_path is None:
+            return layer_obj.transform(data, graph=graph)
+
+        n_components = layer_obj.encode.get_shape()[1].value
+        out = np.lib.format.open_memmap(
+            out_path, mode='w+', dtype=np.float32,
+            shape=(data.shape[0], n_components))
+        layer_obj.transform(data, graph=graph, batch_size=batch_size, out=out)
+        out.flush()
+        del out
+
+        return np.load(out_path, mmap_mode='r')
+
+    def _train_epochs(self, train_op, data, feed_func, validation_feed=None,
+                      epoch_end_func=None):
+        """Run the training loop of the model.
+
+        Batches are prepared in a background thread while the current
+        training step runs, see `yadlt.core.trainers.train_epochs`.
+        If `self.epoch_data_func` is set, it is called with the epoch index
+        and returns the training arrays of that epoch in place of `data`.
+        If `self.epoch_end_hook` is set, it is called with the epoch index
+        at the end of each epoch, after the validation error. Models that
+        support it read the validation set of each epoch from
+        `self.epoch_validation_func`, when it is set.
+        :param train_op: tf node(s) run at each training step
+        :param data: list of aligned training arrays
+        :param feed_func: function mapping one batch of each array in data
+            to the feed dictionary of a training step
+        :param validation_feed: optional, default None. Feed dictionary of
+            the validation set, evaluated at the end of each epoch. If
+            callable, it is called with the epoch index and returns the
+            feed dictionary of that epoch
+        :param epoch_end_func: optional, default None. Function called with
+            the epoch index at the end of each epoch, after the validation
+        :return: self
+        """
+        def run_epoch_end(epoch):
+            if callable(validation_feed):
+                self._run_validation_error_and_summaries(
+                    epoch, validation_feed(epoch))
+            elif validation_feed is not None:
+                self._run_validation_error_and_summaries(
+                    epoch, validation_feed)
+            if epoch_end_func is not None:
+                epoch_end_func(epoch)
+            if self.epoch_end_hook is not None:
+                self.epoch_end_hook(epoch)
+
+        if self.epoch_data_func is not None:
+            data = self.epoch_data_func
+
+        train_epochs(self.tf_session, train_op, data, self.batch_size,
+                     self.num_epochs, feed_func, epoch_end_func=run_epoch_end,
+                     data_pipeline=self.data_pipeline)
+        return self
+
+    def _gen_eval_batches(self, node, data, batch_size, graph=None):
+        """Evaluate `node` over `data` one chunk of rows at a time.
+
+        Only one chunk of `data` is read at a time, so `data` can be a
+        memory-mapped array (e.g. `np.load(path, mmap_mode='r')`).
+        :param node: tf node to evaluate
+        :param data: input data. shape(n_samples, n_features)
+        :param batch_size: number of rows evaluated at each step
+        :param graph: tf graph object
+        :return: generator of np arrays, one per chunk
+        """
+        with self._restored_session(graph) as sess:
+            for i in range(0, data.shape[0], batch_size):
+                batch = tfutils.feed_value(data[i:i + batch_size])
+                yield sess.run(node, {self.input_data: batch,
+                                      self.keep_prob: 1})
+
+    @staticmethod
+    def _fill_from_batches(batches, num_samples, out=None, node=None):
+        """Concatenate the output chunks in `batches` into `out`.
+
+        :param batches: iterable of np arrays
+        :param num_samples: total number of rows of the output
+        :param out: optional, preallocated output array. If None, it is
+            allocated when the first chunk is available.
+        :param node: optional, tf node the chunks are evaluated from. If
+            there are no chunks, out is allocated from its shape and dtype,
+            so that an empty input gives an empty output
+        :return: out
+        """
+        start = 0
+        for batch in batches:
+            if out is None:
+                out = np.empty((num_samples,) + batch.shape[1:],
+                               dtype=batch.dtype)
+            out[start:start + batch.shape[0]] = batch
+            start += batch.shape[0]
+        if out is None and node is not None:
+            out = np.empty([num_samples] + node.get_shape().as_list()[1:],
+                           dtype=node.dtype.as_numpy_dtype)
+        return out
+
+    def compute_regularization(self, vars):
+        """Compute the regularization term of a list of variables.
+
+        :param vars: list of tf variables
+        :return: regularization node, None if regtype is 'none'
+        """
+        if self.regtype == 'none':
+            return None
+        return Regularization(vars, self.l2reg, self.regtype).forward(None)
+
+    def _create_cost_function_node(self, model_output, ref_input,
+                                   regterm=None):
+        """Create the cost function node, see `layers.Loss`.
+
+        :param model_output: model output node
+        :param ref_input: reference input node
+        :param regterm: optional, regularization term added to the cost
+        :return: self
+        """
+        with tf.name_scope("cost"):
+            self.cost = Loss(model_output, ref_input, self.loss_func,
+                             regterm=regterm, name=self.loss_func).loss
+        return self
+
     def get_layers_output(self, dataset):
         """Get output from each layer of the network.
 
@@ -288,12 +778,11 @@ class Model(object):
         """
         layers_out = []
 
-        with self.tf_graph.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                for l in self.layer_nodes:
-                    layers_out.append(l.eval({self.input_data: dataset,
-                                              self.keep_prob: 1}))
+        with self._restored_session() as sess:
+            for l in self.layer_nodes:
+                layers_out.append(sess.run(
+                    l, {self.input_data: tfutils.feed_value(dataset),
+                        self.keep_prob: 1}))
 
         if layers_out == []:
             raise Exception("This method is not implemented for this model")
@@ -304,21 +793,57 @@ class Model(object):
         """Get the parameters of the model.
 
         :param params: dictionary of keys (str names) and values (tensors).
+        :param graph: tf graph object
         :return: evaluated tensors in params
         """
-        g = graph if graph is not None else self.tf_graph
+        with self._restored_session(graph) as sess:
+            out = {}
+            for par in params:
+                if type(params[par]) == list:
+                    for i, p in enumerate(params[par]):
+                        out[par + '-' + str(i+1)] = sess.run(p)
+                else:
+                    out[par] = sess.run(params[par])
+            return out
+
+    def get_dense_parameters(self, graph=None):
+        """Get the weights of the network as a stack of dense layers.
 
-        with g.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                out = {}
-                for par in params:
-                    if type(params[par]) == list:
-                        for i, p in enumerate(params[par]):
-                            out[par + '-' + str(i+1)] = p.eval()
-                    else:
-                        out[par] = params[par].eval()
-                return out
+        :param graph: tf graph object
+        :return: tuple(list of weight matrices, list of biases, list of
+            activation function names), one element per layer
+        """
+        raise Exception("This method is not implemented for this model")
+
+    def save(self, path, graph=None):
+        """Export the network parameters for numpy inference.
+
+        The .npz file holds the weights, biases and activation names of
+        each layer, and it is loaded by inference.DenseNetwork.load, that
+        does not need tensorflow.
+
+        :param path: .npz file path
+        :param graph: tf graph object
+        :return: self
+        """
+        inference.DenseNetwork(*self.get_dense_parameters(graph)).save(path)
+        return self
+
+    def quantize(self, out_path=None, graph=None):
+        """Export the network with int8 weights and per-channel scales.
+
+        :param out_path: optional, default None. If not None, the quantized
+            network is saved to this .npz file
+        :param graph: tf graph object
+        :return: inference.QuantizedNetwork, runs with numpy only
+        """
+        network = inference.QuantizedNetwork.from_float(
+            *self.get_dense_parameters(graph))
+
+        if out_path is not None:
+            network.save(out_path)
+
+        return network
 
 
 class SupervisedModel(Model):
@@ -348,6 +873,11 @@ class SupervisedModel(Model):
 
         g = graph if graph is not None else self.tf_graph
 
+        # the inference session would hold the weights of the old model
+        self.close_session()
+
+        self.sparse_input = sparse.issparse(train_set)
+
         with g.as_default():
             self.build_model(train_set.shape[1], num_classes)
             with tf.Session() as self.tf_session:
@@ -386,17 +916,37 @@ class SupervisedModel(Model):
         if self.verbose == 1:
             print("Accuracy at step %s: %s" % (epoch, acc))
 
-    def predict(self, test_set):
+    def predict(self, test_set, batch_size=None, out=None):
         """Predict the labels for the test set.
 
         :param test_set: Testing data. shape(n_test_samples, n_features)
+        :param batch_size: optional, default None. If not None, the test set
+            is processed in chunks of batch_size rows, so that the memory
+            used does not depend on the size of the test set.
+        :param out: optional, default None. Preallocated output array.
+            shape(n_test_samples,)
         :return: labels
         """
-        with self.tf_graph.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                return self.model_predictions.eval({self.input_data: test_set,
-                                                    self.keep_prob: 1})
+        if batch_size is None and out is None:
+            with self._restored_session() as sess:
+                return sess.run(self.model_predictions,
+                                {self.input_data: tfutils.feed_value(test_set),
+                                 self.keep_prob: 1})
+
+        batches = self.predict_batches(
+            test_set, batch_size or max(1, test_set.shape[0]))
+        return self._fill_from_batches(batches, test_set.shape[0], out,
+                                       node=self.model_predictions)
+
+    def predict_batches(self, test_set, batch_size):
+        """Predict the labels for the test set, one chunk at a time.
+
+        :param test_set: Testing data. shape(n_test_samples, n_features)
+        :param batch_size: number of rows predicted at each step
+        :return: generator of labels, one array per chunk
+        """
+        return self._gen_eval_batches(
+            self.model_predictions, test_set, batch_size)
 
     def compute_accuracy(self, test_set, test_labels):
         """Compute the accuracy over the test set.
@@ -406,12 +956,34 @@ class SupervisedModel(Model):
             shape(n_test_samples, n_classes)
         :return: accuracy
         """
-        with self.tf_graph.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                return self.accuracy.eval({self.input_data: test_set,
-                                           self.input_labels: test_labels,
-                                           self.keep_prob: 1})
+        with self._restored_session() as sess:
+            return sess.run(self.accuracy,
+                            {self.input_data: tfutils.feed_value(test_set),
+                             self.input_labels: test_labels,
+                             self.keep_prob: 1})
+
+    def compare_quantized(self, network, test_set, test_labels,
+                          batch_size=None):
+        """Compare the accuracy of a quantized network with this model.
+
+        :param network: quantized network returned by quantize
+        :param test_set: Testing data. shape(n_test_samples, n_features)
+        :param test_labels: Labels for the test data.
+            shape(n_test_samples, n_classes)
+        :param batch_size: number of rows evaluated at a time by network
+        :return: dict with the float and int8 accuracy and their delta
+        """
+        float_acc = float(self.compute_accuracy(test_set, test_labels))
+        int8_acc = float(np.mean(network.predict(test_set, batch_size) ==
+                                 np.argmax(test_labels, 1)))
+        report = {'float': float_acc, 'int8': int8_acc,
+                  'delta': int8_acc - float_acc}
+
+        if self.verbose == 1:
+            print("Accuracy float: %s, int8: %s, delta: %s" % (
+                float_acc, int8_acc, report['delta']))
+
+        return report
 
     def _create_accuracy_test_node(self):
         """Create the supervised test node of the network.
@@ -438,7 +1010,7 @@ class UnsupervisedModel(Model):
         self.reconstruction = None
 
     def fit(self, train_set, train_ref, validation_set=None,
-            validation_ref=None, graph=None):
+            validation_ref=None, graph=None, save=True, keep_session=False):
         """Fit the model to the data.
 
         :param train_set: Training data. shape(n_samples, n_features)
@@ -448,17 +1020,48 @@ class UnsupervisedModel(Model):
         :param validation_ref: optional, default None.
             Reference validation data. shape(nval_samples, n_features)
         :param graph: tensorflow graph object
+        :param save: optional, default True. Whether to save the trained
+            model to disk. If False, the model can only be used through the
+            session kept with keep_session.
+        :param keep_session: optional, default False. If True, the training
+            session is kept open as the inference session of the model
+            (see `open_session`) and must be closed with `close_session`.
         :return: self
         """
         g = graph if graph is not None else self.tf_graph
 
+        # the inference session would hold the weights of the old model
+        self.close_session()
+
+        self.sparse_input = sparse.issparse(train_set)
+        if self.sparse_input and self.in_graph_data:
+            raise Exception('in_graph_data does not support sparse input')
+
         with g.as_default():
+            self.data_pipeline = None
+            if self.in_graph_data:
+                self.data_pipeline = tfutils.InGraphData(
+                    [train_set], self.batch_size)
             self.build_model(train_set.shape[1])
-            with tf.Session() as self.tf_session:
+            self.tf_session = tf.Session()
+            try:
                 self.tf_merged_summaries, self.tf_summary_writer = tfutils.init_tf_ops(self.tf_session)
+                if self.data_pipeline is not None:
+                    self.data_pipeline.initialize(self.tf_session)
                 self._train_model(
                     train_set, train_ref, validation_set, validation_ref)
-                self.tf_saver.save(self.tf_session, self.model_path)
+                if save:
+                    self.tf_saver.save(self.tf_session, self.model_path)
+                self.unsaved = not save
+            except Exception:
+                self.tf_session.close()
+                raise
+
+            if keep_session:
+                self.tf_inference_session = self.tf_session
+                self.tf_inference_graph = g
+            else:
+                self.tf_session.close()
 
     def build_model(self, num_features):
         """Build model method."""
@@ -490,21 +1093,38 @@ class UnsupervisedModel(Model):
         if self.verbose == 1:
             print("Reconstruction loss at step %s: %s" % (epoch, err))
 
-    def transform(self, data, graph=None):
+    def transform(self, data, graph=None, batch_size=None, out=None):
         """Transform data according to the model.
 
         :param data: Data to transform
         :param graph: tf graph object
+        :param batch_size: optional, default None. If not None, data is
+            transformed in chunks of batch_size rows, so that the memory
+            used does not depend on the size of data.
+        :param out: optional, default None. Preallocated output array.
+            shape(n_samples, n_components)
         :return: transformed data
         """
-        g = graph if graph is not None else self.tf_graph
+        if batch_size is None and out is None:
+            with self._restored_session(graph) as sess:
+                return sess.run(self.encode,
+                                {self.input_data: tfutils.feed_value(data),
+                                 self.keep_prob: 1})
 
-        with g.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                encoded_data = self.encode.eval(
-                    {self.input_data: data, self.keep_prob: 1})
-                return encoded_data
+        batches = self.transform_batches(
+            data, batch_size or max(1, data.shape[0]), graph=graph)
+        return self._fill_from_batches(batches, data.shape[0], out,
+                                       node=self.encode)
+
+    def transform_batches(self, data, batch_size, graph=None):
+        """Transform data according to the model, one chunk at a time.
+
+        :param data: Data to transform
+        :param batch_size: number of rows transformed at each step
+        :param graph: tf graph object
+        :return: generator of transformed data, one array per chunk
+        """
+        return self._gen_eval_batches(self.encode, data, batch_size, graph)
 
     def reconstruct(self, data, graph=None):
         """Reconstruct the test set data using the learned model.
@@ -513,26 +1133,20 @@ class UnsupervisedModel(Model):
         :graph: tf graph object
         :return: labels
         """
-        g = graph if graph is not None else self.tf_graph
-
-        with g.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                return self.reconstruction.eval(
-                    {self.input_data: data, self.keep_prob: 1})
+        with self._restored_session(graph) as sess:
+            return sess.run(self.reconstruction,
+                            {self.input_data: tfutils.feed_value(data),
+                             self.keep_prob: 1})
 
     def compute_reconstruction_loss(self, data, data_ref, graph=None):
         """Compute the reconstruction loss over the test set.
 
         :param data: Data to reconstruct
         :param data_ref: Reference data.
+        :param graph: tf graph object
         :return: reconstruction loss
         """
-        g = graph if graph is not None else self.tf_graph
-
-        with g.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-                return self.cost.eval(
-                    {self.input_data: data,
-                     self.input_labels: data_ref, self.keep_prob: 1})
+        with self._restored_session(graph) as sess:
+            return sess.run(self.cost,
+                            {self.input_data: tfutils.feed_value(data),
+                             self.input_labels: data_ref, self.keep_prob: 1})
@@ -1,6 +1,12 @@
 """Trainers module."""
 
+import six
+from six.moves import queue
+import sys
 import tensorflow as tf
+import threading
+
+from yadlt.utils import utilities
 
 
 class Trainer(object):
@@ -67,3 +73,143 @@ class Trainer(object):
         """
         with tf.name_scope(name_scope):
             return self.opt_.minimize(cost)
+
+
+class BatchPrefetcher(object):
+    """Iterate over a generator of batches run in a background thread.
+
+    While the consumer runs a training step on the current batch, the next
+    batches are prepared by the background thread and stored in a bounded
+    queue.
+    """
+
+    def __init__(self, batches, capacity=2):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        batches : iterable
+            Iterable of batches (or feed dictionaries). It is consumed in the
+            background thread.
+
+        capacity : int, optional (default=2)
+            Maximum number of batches prepared ahead of the consumer.
+        """
+        self._queue = queue.Queue(maxsize=capacity)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(batches,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _produce(self, batches):
+        """Fill the queue with the batches, run in the background thread."""
+        try:
+            for batch in batches:
+                if not self._put(("batch", batch)):
+                    return
+        except Exception:
+            self._put(("error", sys.exc_info()))
+        else:
+            self._put(("end", None))
+
+    def _put(self, item):
+        """Put item in the queue unless the prefetcher has been closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        """Yield the batches in the order they have been generated."""
+        try:
+            while True:
+                kind, value = self._queue.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    six.reraise(*value)
+                yield value
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the background thread."""
+        self._stop.set()
+        self._thread.join()
+
+
+def train_epochs(tf_session, train_op, data, batch_size, num_epochs,
+                 feed_func, shuffle=True, prefetch=2, epoch_end_func=None,
+                 data_pipeline=None):
+    """Run the epoch/batch training loop shared by the models.
+
+    At each epoch `data` is divided into (shuffled) batches, each batch is
+    turned into a feed dictionary by `feed_func` and `train_op` is run on it.
+    If `prefetch` is positive, batches and feed dictionaries (including any
+    input corruption or random tensor done by `feed_func`) are prepared in a
+    background thread while the current training step runs.
+
+    Parameters
+    ----------
+
+    tf_session : tf.Session
+        Session the training ops are run in.
+
+    train_op : tf node or list of tf nodes
+        Ops run at each training step.
+
+    data : list of array_like or callable
+        Aligned training arrays, e.g. [train_set, train_labels]. If callable,
+        it is called with the epoch index at the start of each epoch and
+        returns the arrays of that epoch.
+
+    batch_size : int
+        Size of each batch.
+
+    num_epochs : int
+        Number of training epochs.
+
+    feed_func : callable
+        Called with one batch of each array in `data`, returns the feed
+        dictionary of the training step.
+
+    shuffle : bool, optional (default=True)
+        Whether to shuffle the data at each epoch.
+
+    prefetch : int, optional (default=2)
+        Number of batches prepared ahead by the background thread. If 0, the
+        batches are prepared in the calling thread.
+
+    epoch_end_func : callable, optional (default=None)
+        Called with the epoch index at the end of each epoch, e.g. to compute
+        the validation error.
+
+    data_pipeline : yadlt.utils.tfutils.InGraphData, optional (default=None)
+        If not None, the training batches are gathered in-graph by the
+        pipeline and `data`, `feed_func`, `shuffle` and `prefetch` are
+        ignored.
+    """
+    num_buffers = prefetch + 2 if prefetch > 0 else 1
+
+    for epoch in range(num_epochs):
+        if data_pipeline is not None:
+            data_pipeline.run_epoch(tf_session, train_op)
+
+        else:
+            arrays = data(epoch) if callable(data) else data
+            batches = utilities.gen_minibatches(
+                arrays, batch_size, shuffle=shuffle, num_buffers=num_buffers)
+            feeds = (feed_func(*batch) for batch in batches)
+
+            if prefetch > 0:
+                feeds = BatchPrefetcher(feeds, prefetch)
+
+            for feed in feeds:
+                tf_session.run(train_op, feed_dict=feed)
+
+        if epoch_end_func is not None:
+            epoch_end_func(epoch)
@@ -4,7 +4,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import numpy as np
 import tensorflow as tf
 
 from yadlt.core import UnsupervisedModel
@@ -125,8 +124,18 @@ class DeepAutoencoder(UnsupervisedModel):
 
             self.autoencoder_graphs.append(tf.Graph())
 
-    def pretrain(self, train_set, validation_set=None):
-        """Perform Unsupervised pretraining of the autoencoder."""
+    def pretrain(self, train_set, validation_set=None, save_layers=True,
+                 memmap_encodings=False, pipelined=False):
+        """Perform Unsupervised pretraining of the autoencoder.
+
+        memmap_encodings and pipelined are not supported, the denoising
+        autoencoder layers cannot encode in chunks or train by epoch.
+        """
+        if memmap_encodings or pipelined:
+            raise Exception(
+                'memmap_encodings and pipelined pretraining are not '
+                'supported by denoising autoencoder layers')
+
         self.do_pretrain = True
 
         def set_params_func(autoenc, autoencgraph):
@@ -137,7 +146,28 @@ class DeepAutoencoder(UnsupervisedModel):
         return UnsupervisedModel.pretrain_procedure(
             self, self.autoencoders, self.autoencoder_graphs,
             set_params_func=set_params_func, train_set=train_set,
-            validation_set=validation_set)
+            validation_set=validation_set,
+            save_layers=save_layers, memmap_encodings=memmap_encodings,
+            pipelined=pipelined)
+
+    def get_dense_parameters(self, graph=None):
+        """Get the encoder of the network as a stack of dense layers.
+
+        The output of the stack is the output of transform.
+
+        :param graph: tf graph object
+        :return: tuple(list of weight matrices, list of biases, list of
+            activation function names), one element per layer
+        """
+        params = self.get_parameters({
+            'enc-w': self.encoding_w_, 'enc-b': self.encoding_b_}, graph)
+        n_layers = len(self.layers)
+
+        weights = [params['enc-w-%d' % (l + 1)] for l in range(n_layers)]
+        biases = [params['enc-b-%d' % (l + 1)] for l in range(n_layers)]
+        acts = [f.__name__ if f is not None else 'linear'
+                for f in self.finetune_enc_act_func]
+        return weights, biases, acts
 
     def _train_model(self, train_set, train_ref,
                      validation_set, validation_ref):
@@ -149,26 +179,20 @@ class DeepAutoencoder(UnsupervisedModel):
         :param validation_ref: validation reference data
         :return: self
         """
-        shuff = zip(train_set, train_ref)
-
-        for i in range(self.num_epochs):
-
-            np.random.shuffle(shuff)
-            batches = [_ for _ in utilities.gen_batches(
-                shuff, self.batch_size)]
-
-            for batch in batches:
-                x_batch, y_batch = zip(*batch)
-                self.tf_session.run(
-                    self.train_step,
-                    feed_dict={self.input_data: x_batch,
-                               self.input_labels: y_batch,
-                               self.keep_prob: self.dropout})
-
-            if validation_set is not None:
-                feed = {self.input_data: validation_set,
-                        self.input_labels: validation_ref, self.keep_prob: 1}
-                self._run_validation_error_and_summaries(i, feed)
+        def feed_func(x_batch, y_batch):
+            return {self.input_data: x_batch,
+                    self.input_labels: y_batch,
+                    self.keep_prob: self.dropout}
+
+        validation_feed = None
+        if validation_set is not None:
+            validation_feed = {
+                self.input_data: validation_set,
+                self.input_labels: validation_ref,
+                self.keep_prob: 1}
+
+        self._train_epochs(self.train_step, [train_set, train_ref],
+                           feed_func, validation_feed)
 
     def build_model(self, n_features, encoding_w=None, encoding_b=None):
         """Create the computational graph for the reconstruction task.
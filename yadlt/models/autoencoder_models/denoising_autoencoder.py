@@ -8,8 +8,11 @@ import numpy as np
 import tensorflow as tf
 
 from yadlt.core.layers import Linear, Activation, Regularization, Loss
+from yadlt.core.layers import Corruption
 from yadlt.core import Sequential
 from yadlt.core import Trainer
+from yadlt.core import train_epochs
+from yadlt.utils import tfutils
 from yadlt.utils import utilities
 
 
@@ -26,7 +29,7 @@ class DenoisingAutoencoder(Sequential):
         dec_act_func=None, loss_func='mean_squared', num_epochs=10,
         batch_size=10, opt='sgd', learning_rate=0.01, momentum=0.9,
         corr_type='none', corr_frac=0., verbose=1, regtype='none',
-            l2reg=5e-4):
+            l2reg=5e-4, in_graph_data=False, dtype=tf.float32):
         """Constructor.
 
         Parameters
@@ -82,6 +85,20 @@ class DenoisingAutoencoder(Sequential):
             Regularization parameter. If 0, no regularization. Considered only
             if regtype is not "none".
 
+        in_graph_data : bool, optional (default = False)
+            If True, the training set is stored in the graph and the batches
+            are gathered and corrupted in-graph, so that training steps do
+            not feed any data. The in-graph corruption draws each element
+            independently with probability corr_frac, so the number of
+            corrupted elements per sample varies around
+            corr_frac * n_features, while the fed corruption alters exactly
+            that many elements of every sample.
+
+        dtype : tf.DType, optional (default = tf.float32)
+            Type of the inputs and of the forward pass, e.g. tf.float16 to
+            halve the memory of the activations. The variables are float32
+            master copies, products and the loss are accumulated in float32.
+
         Attributes
         ----------
             name : str
@@ -109,30 +126,69 @@ class DenoisingAutoencoder(Sequential):
         self.corr_type = corr_type
         self.corr_frac = corr_frac
         self.verbose = verbose
+        self.in_graph_data = in_graph_data
+        self.dtype = dtype
+
+        # (min, max) of the training set, used by the in-graph corruption
+        self.data_range = None
+
+    def fit(self, train_set, train_ref=None, val_set=None, val_ref=None):
+        """Train the model, see `Sequential.fit`.
+
+        The min and max of the training set are stored first, so that the
+        in-graph salt and pepper noise uses the same values as the fed one.
+        """
+        self.data_range = None
+        if self.in_graph_data and self.corr_type == 'salt_and_pepper':
+            self.data_range = (float(train_set.min()),
+                               float(train_set.max()))
+        return Sequential.fit(self, train_set, train_ref, val_set, val_ref)
 
     def _run_train_step(self, train_set):
         """Run a training step.
 
-        A training step is made by randomly corrupting the training set,
-        randomly shuffling it,  divide it into batches and run the optimizer
-        for each batch.
+        A training step is made by randomly shuffling the training set,
+        divide it into batches and run the optimizer for each batch.
+        Each batch is corrupted on the fly in the batch prefetching thread,
+        so the training set is never copied.
         :param train_set: training set
         :return: self
         """
-        x_corrupted = utilities._corrupt_input(
-            train_set, self.corr_type, self.corr_frac, self.tf_session)
-
-        shuff = list(zip(train_set, x_corrupted))
-        np.random.shuffle(shuff)
-
-        batches = [_ for _ in utilities.gen_batches(
-            shuff, self.train_params["batch_size"])]
-
-        for batch in batches:
-            x_batch, x_corr_batch = zip(*batch)
-            tr_feed = {self.placeholders["input_orig"]: x_batch,
-                       self.placeholders["input_corr"]: x_corr_batch}
-            self.tf_session.run(self.train_op, feed_dict=tr_feed)
+        if self.data_pipeline is not None:
+            self.data_pipeline.run_epoch(self.tf_session, self.train_op)
+            return
+
+        input_orig = self.placeholders["input_orig"]
+        input_corr = self.placeholders["input_corr"]
+        corruption_ratio = int(np.round(self.corr_frac * train_set.shape[1]))
+
+        feed_value = tfutils.feed_value
+
+        if self.corr_type == 'none' or corruption_ratio <= 0:
+            def feed_func(x_batch):
+                x_batch = feed_value(x_batch)
+                return {input_orig: x_batch, input_corr: x_batch}
+
+        elif self.corr_type == 'masking':
+            def feed_func(x_batch):
+                return {input_orig: feed_value(x_batch),
+                        input_corr: feed_value(utilities.masking_noise(
+                            x_batch, corruption_ratio))}
+
+        elif self.corr_type == 'salt_and_pepper':
+            if self.sparse_input:
+                raise Exception(
+                    'salt_and_pepper corruption does not support sparse '
+                    'input, it would make the data dense')
+            mn, mx = train_set.min(), train_set.max()
+
+            def feed_func(x_batch):
+                return {input_orig: x_batch,
+                        input_corr: utilities.salt_and_pepper_noise(
+                            x_batch, corruption_ratio, mn, mx)}
+
+        train_epochs(self.tf_session, self.train_op, [train_set],
+                     self.train_params["batch_size"], 1, feed_func)
 
     def build_model(self, n_feats):
         """Create the computational graph for a denoising autoencoder.
@@ -149,19 +205,35 @@ class DenoisingAutoencoder(Sequential):
         self
         """
         # Model Input Placeholders
-        input_orig = tf.placeholder(tf.float32, [None, n_feats], name='x')
-        input_corr = tf.placeholder(tf.float32, [None, n_feats], name='corr-x')
+        if self.data_pipeline is not None:
+            # training batches are gathered and corrupted in-graph
+            input_orig = tf.placeholder_with_default(
+                tf.cast(self.data_pipeline.batches[0], self.dtype),
+                [None, n_feats], name='x')
+            mn, mx = self.data_range or (None, None)
+            corruption = Corruption(self.corr_type, self.corr_frac, mn, mx)
+            input_corr = tf.placeholder_with_default(
+                corruption.forward(input_orig), [None, n_feats],
+                name='corr-x')
+        else:
+            input_orig = tfutils.input_placeholder(
+                n_feats, self.sparse_input, name='x', dtype=self.dtype)
+            input_corr = tfutils.input_placeholder(
+                n_feats, self.sparse_input, name='corr-x', dtype=self.dtype)
         self.add_placeholder("input_orig", input_orig)
         self.add_placeholder("input_corr", input_corr)
 
         # Model Architecture
-        self.add(Linear((n_feats, self.n_components), name="encoder"))\
+        self.add(Linear((n_feats, self.n_components), name="encoder",
+                        dtype=self.dtype))\
             .add(Activation(self.enc_act_func, name="encoder-act"))\
-            .add(Linear((self.n_components, n_feats), name="decoder"))\
+            .add(Linear((self.n_components, n_feats), name="decoder",
+                        dtype=self.dtype))\
             .add(Activation(self.dec_act_func, name="decoder-act"))
 
         # Model Training loss and Backpropagation
-        loss = Loss(self.forward("input_corr"), input_orig,
+        loss = Loss(self.forward("input_corr"),
+                    tfutils.input_to_dense(input_orig),
                     self.train_params["loss_func"])
         self.train_op = self.trainer.compile(loss.loss)
 
@@ -4,12 +4,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import numpy as np
 import tensorflow as tf
 
 from yadlt.core import SupervisedModel
 from yadlt.core import Trainer
 from yadlt.models.autoencoder_models import denoising_autoencoder
+from yadlt.utils import tfutils
 from yadlt.utils import utilities
 
 
@@ -29,7 +29,7 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         finetune_loss_func='softmax_cross_entropy',
         finetune_act_func=tf.nn.relu, finetune_opt='gradient_descent',
         finetune_learning_rate=0.001, finetune_num_epochs=10,
-            finetune_batch_size=20, do_pretrain=False):
+            finetune_batch_size=20, do_pretrain=False, dtype=tf.float32):
         """Constructor.
 
         :param layers: list containing the hidden units for each layer
@@ -55,6 +55,10 @@ class StackedDenoisingAutoencoder(SupervisedModel):
             int, default 0
         :param do_pretrain: True: uses variables from pretraining,
             False: initialize new variables.
+        :param dtype: type of the inputs and of the forward pass of the
+            autoencoders and of the finetuning encoding layers, e.g.
+            tf.float16. The parameters are float32 master variables.
+            default tf.float32
         """
         # WARNING! This must be the first expression in the function or else it
         # will send other variables to expanded_args()
@@ -77,6 +81,7 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         self.layers = layers
         self.finetune_act_func = finetune_act_func
         self.verbose = verbose
+        self.dtype = dtype
 
         # Model parameters
         self.encoding_w_ = []  # list of matrices of encoding weights per layer
@@ -104,12 +109,23 @@ class StackedDenoisingAutoencoder(SupervisedModel):
                     corr_type=expanded_args['corr_type'][l],
                     corr_frac=expanded_args['corr_frac'][l],
                     num_epochs=expanded_args['num_epochs'][l],
-                    batch_size=expanded_args['batch_size'][l]))
+                    batch_size=expanded_args['batch_size'][l],
+                    dtype=dtype))
 
             self.autoencoder_graphs.append(tf.Graph())
 
-    def pretrain(self, train_set, validation_set=None):
-        """Perform Unsupervised pretraining of the autoencoder."""
+    def pretrain(self, train_set, validation_set=None, save_layers=True,
+                 memmap_encodings=False, pipelined=False):
+        """Perform Unsupervised pretraining of the autoencoder.
+
+        memmap_encodings and pipelined are not supported, the denoising
+        autoencoder layers cannot encode in chunks or train by epoch.
+        """
+        if memmap_encodings or pipelined:
+            raise Exception(
+                'memmap_encodings and pipelined pretraining are not '
+                'supported by denoising autoencoder layers')
+
         self.do_pretrain = True
 
         def set_params_func(autoenc, autoencgraph):
@@ -120,7 +136,28 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         return SupervisedModel.pretrain_procedure(
             self, self.autoencoders, self.autoencoder_graphs,
             set_params_func=set_params_func, train_set=train_set,
-            validation_set=validation_set)
+            validation_set=validation_set,
+            save_layers=save_layers, memmap_encodings=memmap_encodings,
+            pipelined=pipelined)
+
+    def get_dense_parameters(self, graph=None):
+        """Get the weights of the network as a stack of dense layers.
+
+        :param graph: tf graph object
+        :return: tuple(list of weight matrices, list of biases, list of
+            activation function names), one element per layer
+        """
+        params = self.get_parameters({
+            'enc-w': self.encoding_w_, 'enc-b': self.encoding_b_,
+            'last-w': self.last_W, 'last-b': self.last_b}, graph)
+        n_layers = len(self.layers)
+        act = (self.finetune_act_func.__name__
+               if self.finetune_act_func else 'linear')
+
+        weights = [params['enc-w-%d' % (l + 1)] for l in range(n_layers)]
+        biases = [params['enc-b-%d' % (l + 1)] for l in range(n_layers)]
+        return (weights + [params['last-w']], biases + [params['last-b']],
+                [act] * n_layers + ['linear'])
 
     def _train_model(self, train_set, train_labels,
                      validation_set, validation_labels):
@@ -132,27 +169,20 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         :param validation_labels: validation labels
         :return: self
         """
-        shuff = zip(train_set, train_labels)
-
-        for i in range(self.num_epochs):
-
-            np.random.shuffle(shuff)
-            batches = [_ for _ in utilities.gen_batches(
-                shuff, self.batch_size)]
+        def feed_func(x_batch, y_batch):
+            return {self.input_data: tfutils.feed_value(x_batch),
+                    self.input_labels: y_batch,
+                    self.keep_prob: self.dropout}
 
-            for batch in batches:
-                x_batch, y_batch = zip(*batch)
-                self.tf_session.run(
-                    self.train_step,
-                    feed_dict={self.input_data: x_batch,
-                               self.input_labels: y_batch,
-                               self.keep_prob: self.dropout})
+        validation_feed = None
+        if validation_set is not None:
+            validation_feed = {
+                self.input_data: tfutils.feed_value(validation_set),
+                self.input_labels: validation_labels,
+                self.keep_prob: 1}
 
-            if validation_set is not None:
-                feed = {self.input_data: validation_set,
-                        self.input_labels: validation_labels,
-                        self.keep_prob: 1}
-                self._run_validation_error_and_summaries(i, feed)
+        self._train_epochs(self.train_step, [train_set, train_labels],
+                           feed_func, validation_feed)
 
     def build_model(self, n_features, n_classes):
         """Create the computational graph.
@@ -182,8 +212,8 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         :param n_classes: number of classes
         :return: self
         """
-        self.input_data = tf.placeholder(
-            tf.float32, [None, n_features], name='x-input')
+        self.input_data = tfutils.input_placeholder(
+            n_features, self.sparse_input, dtype=self.dtype)
         self.input_labels = tf.placeholder(
             tf.float32, [None, n_classes], name='y-input')
         self.keep_prob = tf.placeholder(
@@ -242,14 +272,17 @@ class StackedDenoisingAutoencoder(SupervisedModel):
         """
         next_train = self.input_data
         self.layer_nodes = []
+        keep_prob = tf.cast(self.keep_prob, self.dtype)
 
         for l, layer in enumerate(self.layers):
 
             with tf.name_scope("encode-{}".format(l)):
 
+                # float32 master variables cast to the forward pass type
                 y_act = tf.add(
-                    tf.matmul(next_train, self.encoding_w_[l]),
-                    self.encoding_b_[l]
+                    tfutils.input_matmul(
+                        next_train, tf.cast(self.encoding_w_[l], self.dtype)),
+                    tf.cast(self.encoding_b_[l], self.dtype)
                 )
 
                 if self.finetune_act_func:
@@ -259,8 +292,9 @@ class StackedDenoisingAutoencoder(SupervisedModel):
                     layer_y = None
 
                 # the input to the next layer is the output of this layer
-                next_train = tf.nn.dropout(layer_y, self.keep_prob)
+                next_train = tf.nn.dropout(layer_y, keep_prob)
 
             self.layer_nodes.append(next_train)
 
-        return next_train
+        # the last layer and the loss run in float32
+        return tf.cast(next_train, tf.float32)
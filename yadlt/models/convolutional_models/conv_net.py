@@ -4,12 +4,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import numpy as np
 import tensorflow as tf
 
 from yadlt.core import SupervisedModel
 from yadlt.core import Trainer
-from yadlt.utils import utilities
 
 
 class ConvolutionalNetwork(SupervisedModel):
@@ -71,27 +69,20 @@ class ConvolutionalNetwork(SupervisedModel):
         :param validation_labels: validation labels
         :return: self
         """
-        shuff = zip(train_set, train_labels)
-
-        for i in range(self.num_epochs):
-
-            np.random.shuffle(list(shuff))
-            batches = [_ for _ in utilities.gen_batches(
-                shuff, self.batch_size)]
-
-            for batch in batches:
-                x_batch, y_batch = zip(*batch)
-                self.tf_session.run(
-                    self.train_step,
-                    feed_dict={self.input_data: x_batch,
-                               self.input_labels: y_batch,
-                               self.keep_prob: self.dropout})
-
-            if validation_set is not None:
-                feed = {self.input_data: validation_set,
-                        self.input_labels: validation_labels,
-                        self.keep_prob: 1}
-                self._run_validation_error_and_summaries(i, feed)
+        def feed_func(x_batch, y_batch):
+            return {self.input_data: x_batch,
+                    self.input_labels: y_batch,
+                    self.keep_prob: self.dropout}
+
+        validation_feed = None
+        if validation_set is not None:
+            validation_feed = {
+                self.input_data: validation_set,
+                self.input_labels: validation_labels,
+                self.keep_prob: 1}
+
+        self._train_epochs(self.train_step, [train_set, train_labels],
+                           feed_func, validation_feed)
 
     def build_model(self, n_features, n_classes):
         """Create the computational graph of the model.
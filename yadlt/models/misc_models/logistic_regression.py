@@ -4,12 +4,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import numpy as np
 import tensorflow as tf
 
 from yadlt.core import SupervisedModel
 from yadlt.core import Trainer
-from yadlt.utils import utilities
+from yadlt.utils import tfutils
 
 
 class LogisticRegression(SupervisedModel):
@@ -55,7 +54,7 @@ class LogisticRegression(SupervisedModel):
         self._create_variables(n_features, n_classes)
 
         self.last_out = tf.nn.softmax(
-            tf.add(tf.matmul(self.input_data, self.W_), self.b_))
+            tf.add(tfutils.input_matmul(self.input_data, self.W_), self.b_))
 
         self._create_cost_function_node(self.last_out, self.input_labels)
         self.train_step = Trainer(
@@ -69,8 +68,8 @@ class LogisticRegression(SupervisedModel):
         :param n_classes: number of classes
         :return: self
         """
-        self.input_data = tf.placeholder(
-            tf.float32, [None, n_features], name='x-input')
+        self.input_data = tfutils.input_placeholder(
+            n_features, self.sparse_input)
         self.input_labels = tf.placeholder(
             tf.float32, [None, n_classes], name='y-input')
         self.keep_prob = tf.placeholder(
@@ -98,21 +97,15 @@ class LogisticRegression(SupervisedModel):
         :param validation_labels: validation labels
         :return: self
         """
-        for i in range(self.num_epochs):
-
-            shuff = list(zip(train_set, train_labels))
-            np.random.shuffle(shuff)
-
-            batches = [_ for _ in utilities.gen_batches(shuff, self.batch_size)]
-
-            for batch in batches:
-                x_batch, y_batch = zip(*batch)
-                self.tf_session.run(
-                    self.train_step,
-                    feed_dict={self.input_data: x_batch,
-                               self.input_labels: y_batch})
-
-            if validation_set is not None:
-                feed = {self.input_data: validation_set,
-                        self.input_labels: validation_labels}
-                self._run_validation_error_and_summaries(i, feed)
+        def feed_func(x_batch, y_batch):
+            return {self.input_data: tfutils.feed_value(x_batch),
+                    self.input_labels: y_batch}
+
+        validation_feed = None
+        if validation_set is not None:
+            validation_feed = {
+                self.input_data: tfutils.feed_value(validation_set),
+                self.input_labels: validation_labels}
+
+        self._train_epochs(self.train_step, [train_set, train_labels],
+                           feed_func, validation_feed)
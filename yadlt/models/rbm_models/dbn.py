@@ -10,7 +10,7 @@ import tensorflow as tf
 from yadlt.core import SupervisedModel
 from yadlt.core import Trainer
 from yadlt.models.rbm_models import rbm
-from yadlt.utils import utilities
+from yadlt.utils import tfutils
 
 
 class DeepBeliefNetwork(SupervisedModel):
@@ -27,7 +27,8 @@ class DeepBeliefNetwork(SupervisedModel):
         finetune_loss_func='softmax_cross_entropy',
         finetune_act_func=tf.nn.sigmoid, finetune_opt='gradient_descent',
         finetune_learning_rate=0.001, finetune_num_epochs=10,
-            finetune_batch_size=20, verbose=1, momentum=0.5,):
+            finetune_batch_size=20, verbose=1, momentum=0.5,
+            dtype=tf.float32):
         """Constructor.
 
         :param rbm_layers: list containing the hidden units for each layer
@@ -46,6 +47,9 @@ class DeepBeliefNetwork(SupervisedModel):
             int, default 0
         :param do_pretrain: True: uses variables from pretraining,
             False: initialize new variables.
+        :param dtype: type of the inputs and of the forward pass of the rbms
+            and of the finetuning encoding layers, e.g. tf.float16. The
+            parameters are float32 master variables. default tf.float32
         """
         SupervisedModel.__init__(self, name)
 
@@ -55,6 +59,7 @@ class DeepBeliefNetwork(SupervisedModel):
         self.layers = rbm_layers
         self.finetune_act_func = finetune_act_func
         self.verbose = verbose
+        self.dtype = dtype
 
         # Model parameters
         self.encoding_w_ = []  # list of matrices of encoding weights per layer
@@ -89,7 +94,8 @@ class DeepBeliefNetwork(SupervisedModel):
                         num_epochs=rbm_params['num_epochs'][l],
                         batch_size=rbm_params['batch_size'][l],
                         gibbs_sampling_steps=rbm_params['gibbs_k'][l],
-                        visible_unit_type='gauss', stddev=rbm_stddev))
+                        visible_unit_type='gauss', stddev=rbm_stddev,
+                        dtype=dtype))
 
             else:
                 self.rbms.append(
@@ -100,22 +106,136 @@ class DeepBeliefNetwork(SupervisedModel):
                         verbose=self.verbose,
                         num_epochs=rbm_params['num_epochs'][l],
                         batch_size=rbm_params['batch_size'][l],
-                        gibbs_sampling_steps=rbm_params['gibbs_k'][l]))
+                        gibbs_sampling_steps=rbm_params['gibbs_k'][l],
+                        dtype=dtype))
 
             self.rbm_graphs.append(tf.Graph())
 
-    def pretrain(self, train_set, validation_set=None):
+    def pretrain(self, train_set, validation_set=None, save_layers=True,
+                 memmap_encodings=False, pipelined=False):
         """Perform Unsupervised pretraining of the DBN."""
         self.do_pretrain = True
 
         def set_params_func(rbmmachine, rbmgraph):
-            params = rbmmachine.get_parameters(graph=rbmgraph)
-            self.encoding_w_.append(params['W'])
-            self.encoding_b_.append(params['bh_'])
+            W, bh = rbmmachine.get_encoding_parameters(graph=rbmgraph)
+            self.encoding_w_.append(W)
+            self.encoding_b_.append(bh)
 
         return SupervisedModel.pretrain_procedure(
             self, self.rbms, self.rbm_graphs, set_params_func=set_params_func,
-            train_set=train_set, validation_set=validation_set)
+            train_set=train_set, validation_set=validation_set,
+            save_layers=save_layers, memmap_encodings=memmap_encodings,
+            pipelined=pipelined)
+
+    def free_energy(self, data, batch_size=1000):
+        """Compute the free energy of each sample of data under the top RBM.
+
+        Each batch of data is propagated through the lower rbms (hidden
+        probabilities) and scored by the top rbm. The rbms are restored
+        once for the whole data, which can be a memory-mapped array.
+        :param data: data to score. shape(n_samples, n_features)
+        :param batch_size: number of rows processed at a time
+        :return: free energies. shape(n_samples,)
+        """
+        opened = []
+        try:
+            for r, graph in zip(self.rbms, self.rbm_graphs):
+                if r.tf_inference_session is None:
+                    r.open_session(graph)
+                    opened.append(r)
+
+            batches = (self._top_free_energy(data[i:i + batch_size])
+                       for i in range(0, data.shape[0], batch_size))
+            return self._fill_from_batches(
+                batches, data.shape[0], node=self.rbms[-1].free_energy_node)
+        finally:
+            for r in opened:
+                r.close_session()
+
+    def _top_free_energy(self, data):
+        """Free energy under the top rbm of a batch of input data."""
+        for r, graph in zip(self.rbms[:-1], self.rbm_graphs[:-1]):
+            data = r.transform(data, graph=graph)
+        return self.rbms[-1].free_energy(
+            data, graph=self.rbm_graphs[-1], batch_size=data.shape[0])
+
+    def score_samples(self, data, batch_size=1000):
+        """Compute the unnormalized log-likelihood of each sample of data.
+
+        :param data: data to score. shape(n_samples, n_features)
+        :param batch_size: number of rows processed at a time
+        :return: minus the free energies under the top rbm
+        """
+        return -self.free_energy(data, batch_size)
+
+    def sample(self, n, k_steps=1, burn_in=1000, num_chains=100,
+               out_path=None, rng=None):
+        """Draw samples of the input units from the network.
+
+        The samples of the top rbm are propagated down through the lower
+        rbms (visible probabilities), one batch at a time.
+        :param n: number of samples
+        :param k_steps: number of gibbs steps of the top rbm between samples
+        :param burn_in: number of gibbs steps of the top rbm before the
+            first sample
+        :param num_chains: number of parallel chains of the top rbm
+        :param out_path: optional, path of a .npy file the samples are
+            written to batch by batch. If None, the samples are returned as
+            an in-memory array
+        :param rng: numpy random number generator
+        :return: samples. shape(n, n_features), memory-mapped read-only if
+            out_path is given
+        """
+        lower = [r.get_parameters(graph=graph) for r, graph in
+                 zip(self.rbms[:-1], self.rbm_graphs[:-1])]
+
+        def propagate_down(batch):
+            for params in reversed(lower):
+                activation = np.dot(batch, params['W'].T)
+                if 'sigma' in params:
+                    # mean of gaussian visible units
+                    batch = params['bv_'] + params['sigma'] * activation
+                else:
+                    batch = 1. / (1. + np.exp(-(activation + params['bv_'])))
+            return batch
+
+        batches = (propagate_down(batch) for batch in
+                   self.rbms[-1].sample_batches(
+                       n, k_steps, burn_in, num_chains,
+                       graph=self.rbm_graphs[-1], rng=rng))
+        if out_path is None:
+            return self._fill_from_batches(batches, n)
+
+        if lower:
+            n_features = lower[0]['W'].shape[0]
+        else:
+            n_features = self.rbms[-1].sample_start.get_shape()[1].value
+        out = np.lib.format.open_memmap(
+            out_path, mode='w+', dtype=np.float32, shape=(n, n_features))
+        self._fill_from_batches(batches, n, out)
+        out.flush()
+        del out
+
+        return np.load(out_path, mmap_mode='r')
+
+    def get_dense_parameters(self, graph=None):
+        """Get the weights of the network as a stack of dense layers.
+
+        :param graph: tf graph object
+        :return: tuple(list of weight matrices, list of biases, list of
+            activation function names), one element per layer
+        """
+        params = self.get_parameters({
+            'enc-w': self.encoding_w_, 'enc-b': self.encoding_b_,
+            'last-w': self.softmax_W, 'last-b': self.softmax_b}, graph)
+        n_layers = len(self.layers)
+        act = (self.finetune_act_func.__name__
+               if self.finetune_act_func else 'linear')
+
+        weights = [params['enc-w-%d' % (l + 1)] for l in range(n_layers)]
+        biases = [params['enc-b-%d' % (l + 1)] for l in range(n_layers)]
+        return (weights + [params['last-w']], biases + [params['last-b']],
+                [act] * n_layers + ['linear'])
 
     def _train_model(self, train_set, train_labels,
                      validation_set, validation_labels):
@@ -127,27 +247,20 @@ class DeepBeliefNetwork(SupervisedModel):
         :param validation_labels: validation labels
         :return: self
         """
-        shuff = zip(train_set, train_labels)
-
-        for i in range(self.num_epochs):
-
-            np.random.shuffle(shuff)
-            batches = [_ for _ in utilities.gen_batches(
-                shuff, self.batch_size)]
+        def feed_func(x_batch, y_batch):
+            return {self.input_data: tfutils.feed_value(x_batch),
+                    self.input_labels: y_batch,
+                    self.keep_prob: self.dropout}
 
-            for batch in batches:
-                x_batch, y_batch = zip(*batch)
-                self.tf_session.run(
-                    self.train_step, feed_dict={
-                        self.input_data: x_batch,
-                        self.input_labels: y_batch,
-                        self.keep_prob: self.dropout})
+        validation_feed = None
+        if validation_set is not None:
+            validation_feed = {
+                self.input_data: tfutils.feed_value(validation_set),
+                self.input_labels: validation_labels,
+                self.keep_prob: 1}
 
-            if validation_set is not None:
-                feed = {self.input_data: validation_set,
-                        self.input_labels: validation_labels,
-                        self.keep_prob: 1}
-                self._run_validation_error_and_summaries(i, feed)
+        self._train_epochs(self.train_step, [train_set, train_labels],
+                           feed_func, validation_feed)
 
     def build_model(self, n_features, n_classes):
         """Create the computational graph.
@@ -176,8 +289,8 @@ class DeepBeliefNetwork(SupervisedModel):
         :param n_classes: number of classes
         :return: self
         """
-        self.input_data = tf.placeholder(
-            tf.float32, [None, n_features], name='x-input')
+        self.input_data = tfutils.input_placeholder(
+            n_features, self.sparse_input, dtype=self.dtype)
 
         self.input_labels = tf.placeholder(
             tf.float32, [None, n_classes], name='y-input')
@@ -235,14 +348,17 @@ class DeepBeliefNetwork(SupervisedModel):
         """
         next_train = self.input_data
         self.layer_nodes = []
+        keep_prob = tf.cast(self.keep_prob, self.dtype)
 
         for l, layer in enumerate(self.layers):
 
             with tf.name_scope("encode-{}".format(l)):
 
+                # float32 master variables cast to the forward pass type
                 y_act = tf.add(
-                    tf.matmul(next_train, self.encoding_w_[l]),
-                    self.encoding_b_[l]
+                    tfutils.input_matmul(
+                        next_train, tf.cast(self.encoding_w_[l], self.dtype)),
+                    tf.cast(self.encoding_b_[l], self.dtype)
                 )
 
                 if self.finetune_act_func:
@@ -252,8 +368,9 @@ class DeepBeliefNetwork(SupervisedModel):
                     layer_y = None
 
                 # the input to the next layer is the output of this layer
-                next_train = tf.nn.dropout(layer_y, self.keep_prob)
+                next_train = tf.nn.dropout(layer_y, keep_prob)
 
             self.layer_nodes.append(next_train)
 
-        return next_train
+        # the last layer and the loss run in float32
+        return tf.cast(next_train, tf.float32)
@@ -5,9 +5,11 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+from scipy import sparse
 import tensorflow as tf
 
 from yadlt.core import UnsupervisedModel
+from yadlt.utils import tfutils
 from yadlt.utils import utilities
 
 
@@ -21,18 +23,59 @@ class RBM(UnsupervisedModel):
         self, num_hidden, visible_unit_type='bin',
         name='rbm', loss_func='mean_squared',
         l2reg=5e-4, regtype='none', gibbs_sampling_steps=1, learning_rate=0.01,
-            batch_size=10, num_epochs=10, stddev=0.1, verbose=0):
+            batch_size=10, num_epochs=10, stddev=0.1, verbose=0,
+            in_graph_data=False, persistent_cd=False, in_graph_rng=False,
+            seed=None, gibbs_loop=False, gibbs_k_schedule=None,
+            learn_sigma=False, gauss_mean_field=False, dtype=tf.float32):
         """Constructor.
 
         :param num_hidden: number of hidden units
         :param loss_function: type of loss function
-        :param visible_unit_type: type of the visible units (bin, gauss or rsm)
+        :param visible_unit_type: type of the visible units (bin, gauss or
+            rsm). 'rsm' is the Replicated Softmax model of word counts: the
+            hidden biases are scaled by the length of each document and the
+            visible counts are sampled from a multinomial
         :param gibbs_sampling_steps: optional, default 1
-        :param stddev: default 0.1. Ignored if visible_unit_type is not 'gauss'
+        :param stddev: default 0.1. Initial standard deviation of each
+            gaussian visible unit. Ignored if visible_unit_type is not 'gauss'
         :param verbose: level of verbosity. optional, default 0
+        :param in_graph_data: if True, the training set is stored in the
+            graph and the batches and random values are generated in-graph,
+            so that training steps do not feed any data. optional,
+            default False
+        :param persistent_cd: if True, train with Persistent Contrastive
+            Divergence: the negative statistics are computed by batch_size
+            fantasy particles that are not reset to the data at each update,
+            but advanced by gibbs_sampling_steps steps from their previous
+            state. optional, default False
+        :param in_graph_rng: if True, the random values used to sample the
+            units are generated in-graph instead of being fed, so that the
+            training steps feed only the data batch. Always True if
+            in_graph_data is True. optional, default False
+        :param seed: graph-level random seed, makes the in-graph random
+            values reproducible. optional, default None
+        :param gibbs_loop: if True, the gibbs chain is a tf.while_loop and
+            the number of steps is read from the self.gibbs_k variable at
+            run time, instead of being unrolled in the graph.
+            optional, default False
+        :param gibbs_k_schedule: function mapping the epoch index to the
+            number of gibbs sampling steps of that epoch, e.g. to increase k
+            during training. Requires gibbs_loop. optional, default None
+        :param learn_sigma: if True, the standard deviations of the gaussian
+            visible units are learned. optional, default False
+        :param gauss_mean_field: if True, the gaussian visible units are set
+            to their mean instead of being sampled. optional, default False
+        :param dtype: type of the inputs and of the forward pass, e.g.
+            tf.float16 to halve the memory of the activations. The
+            parameters are float32 master variables cast to dtype for the
+            forward pass, the products and the means over the batch are
+            accumulated in float32 and the updates are applied in float32.
+            optional, default tf.float32
         """
         UnsupervisedModel.__init__(self, name)
 
+        self.in_graph_data = in_graph_data
+
         self.loss_func = loss_func
         self.learning_rate = learning_rate
         self.num_epochs = num_epochs
@@ -43,55 +86,131 @@ class RBM(UnsupervisedModel):
         self.num_hidden = num_hidden
         self.visible_unit_type = visible_unit_type
         self.gibbs_sampling_steps = gibbs_sampling_steps
+        self.persistent_cd = persistent_cd
+        self.in_graph_rng = in_graph_rng
+        self.seed = seed
+        self.gibbs_loop = gibbs_loop
+        self.gibbs_k_schedule = gibbs_k_schedule
         self.stddev = stddev
+        self.learn_sigma = learn_sigma
+        self.gauss_mean_field = gauss_mean_field
+        self.dtype = dtype
         self.verbose = verbose
 
+        # float32 master parameters
         self.W = None
         self.bh_ = None
         self.bv_ = None
 
+        # parameters cast to dtype, used by the forward pass
+        self._W = None
+        self._bh = None
+        self._bv = None
+
+        # standard deviations of the gaussian visible units, sigma is dtype
+        self.log_sigma = None
+        self.sigma = None
+        self.sigma_upd8 = None
+
         self.w_upd8 = None
         self.bh_upd8 = None
         self.bv_upd8 = None
 
+        # fantasy particles of persistent contrastive divergence
+        self.chain = None
+        self.chain_upd8 = None
+
+        # lengths of training documents, seed the 'rsm' sampling chains
+        self.doc_lengths_ = None
+
+        # training rows the chain and the document lengths start from
+        self._data_rows = None
+        self._seed_from_data = None
+
+        # number of gibbs sampling steps of the chain, if gibbs_loop is True
+        self.gibbs_k = None
+        self._gibbs_k_value = None
+        self._gibbs_k_assign = None
+
         self.cost = None
+        self.free_energy_node = None
+
+        # persistent chains used by `sample`
+        self.sample_start = None
+        self.sample_steps = None
+        self.sample_states = None
 
         self.input_data = None
         self.hrand = None
         self.vrand = None
 
-    def _train_model(self, train_set, validation_set,
-                     train_ref=None, Validation_ref=None):
+        # length of the input documents, used if visible_unit_type is 'rsm'
+        self.doc_length = None
+
+    def _train_model(self, train_set, train_ref,
+                     validation_set, validation_ref):
         """Train the model.
 
         :param train_set: training set
+        :param train_ref: training reference data, not used by this model
         :param validation_set: validation set. optional, default None
+        :param validation_ref: validation reference data, not used
         :return: self
         """
-        for i in range(self.num_epochs):
-            self._run_train_step(train_set)
-
-            if validation_set is not None:
-                self._run_validation_error_and_summaries(
-                    i, self._create_feed_dict(validation_set))
+        if self._seed_from_data is not None:
+            self._seed_chains(train_set)
 
-    def _run_train_step(self, train_set):
-        """Run a training step.
-
-        A training step is made by randomly shuffling the training set,
-        divide into batches and run the variable update nodes for each batch.
+        updates = [self.w_upd8, self.bh_upd8, self.bv_upd8]
+        if self.chain_upd8 is not None:
+            updates.append(self.chain_upd8)
+        if self.sigma_upd8 is not None:
+            updates.append(self.sigma_upd8)
+
+        validation_feed = None
+        if validation_set is not None:
+            # the sampling uniforms are drawn again at each epoch
+            def validation_feed(epoch):
+                if self.epoch_validation_func is not None:
+                    return self._create_feed_dict(
+                        self.epoch_validation_func(epoch))
+                return self._create_feed_dict(validation_set)
+
+        epoch_end_func = None
+        if self.gibbs_k_schedule is not None:
+            self._set_gibbs_k(self.gibbs_k_schedule(0))
+
+            def epoch_end_func(epoch):
+                self._set_gibbs_k(self.gibbs_k_schedule(epoch + 1))
+
+        self._train_epochs(updates, [train_set], self._create_feed_dict,
+                           validation_feed, epoch_end_func=epoch_end_func)
+
+    def _seed_chains(self, train_set):
+        """Start the persistent chain from rows of the training set.
+
+        As in standard PCD the fantasy particles start from data, rows
+        drawn with replacement. With 'rsm' visible units the lengths of the
+        rows are stored to seed the chains of `sample`.
         :param train_set: training set
         :return: self
         """
-        np.random.shuffle(train_set)
-
-        batches = [_ for _ in utilities.gen_batches(train_set,
-                                                    self.batch_size)]
-        updates = [self.w_upd8, self.bh_upd8, self.bv_upd8]
-
-        for batch in batches:
-            self.tf_session.run(updates,
-                                feed_dict=self._create_feed_dict(batch))
+        rows = train_set[np.sort(np.random.randint(
+            train_set.shape[0], size=self.batch_size))]
+        if sparse.issparse(rows):
+            rows = rows.toarray()
+        self.tf_session.run(self._seed_from_data,
+                            feed_dict={self._data_rows: rows})
+        return self
+
+    def _set_gibbs_k(self, k):
+        """Set the number of gibbs sampling steps of the while_loop chain.
+
+        :param k: number of gibbs sampling steps
+        :return: self
+        """
+        self.tf_session.run(self._gibbs_k_assign,
+                            feed_dict={self._gibbs_k_value: k})
+        return self
 
     def _create_feed_dict(self, data):
         """Create the dictionary of data to feed to tf session during training.
@@ -100,8 +219,11 @@ class RBM(UnsupervisedModel):
         :return: dictionary(self.input_data: data, self.hrand: random_uniform,
                             self.vrand: random_uniform)
         """
+        if self.in_graph_rng or self.data_pipeline is not None:
+            return {self.input_data: tfutils.feed_value(data)}
+
         return {
-            self.input_data: data,
+            self.input_data: tfutils.feed_value(data),
             self.hrand: np.random.rand(data.shape[0], self.num_hidden),
             self.vrand: np.random.rand(data.shape[0], data.shape[1])
         }
@@ -113,41 +235,128 @@ class RBM(UnsupervisedModel):
         :param regtype: regularization type
         :return: self
         """
+        if self.gibbs_k_schedule is not None and not self.gibbs_loop:
+            raise Exception('gibbs_k_schedule requires gibbs_loop=True')
+
+        if self.seed is not None:
+            tf.set_random_seed(self.seed)
+
         self._create_placeholders(n_features)
         self._create_variables(n_features)
+        self.doc_length = self._doc_length(self.input_data)
         self.encode = self.sample_hidden_from_visible(self.input_data)[0]
         self.reconstruction = self.sample_visible_from_hidden(
             self.encode, n_features)[0]
+        self.free_energy_node = self._create_free_energy_node(
+            self.input_data)
+
+        # chains advanced by a runtime number of steps, see `sample`
+        self.sample_start = tf.placeholder(
+            self.dtype, [None, n_features], name='sample-start')
+        self.sample_steps = tf.placeholder(tf.int32, [], name='sample-steps')
+        self.sample_states = self._gibbs_chain(
+            self.sample_start, self.sample_steps, n_features,
+            sample_states=True, loop=True)[1]
 
         hprob0, hstate0, vprob, vstate, hprob1, hstate1 =\
             self.gibbs_sampling_step(self.input_data, n_features)
         positive = self.compute_positive_association(self.input_data,
                                                      hprob0, hstate0)
 
-        nn_input = vprob
+        recon_vprob = vprob
 
-        for step in range(self.gibbs_sampling_steps - 1):
-            hprob, hstate, vprob, vstate, hprob1, hstate1 =\
-                self.gibbs_sampling_step(nn_input, n_features)
-            nn_input = vprob
+        if self.gibbs_loop:
+            self.gibbs_k = tf.Variable(
+                self.gibbs_sampling_steps, trainable=False, name='gibbs-k')
+            self._gibbs_k_value = tf.placeholder(tf.int32, [])
+            self._gibbs_k_assign = self.gibbs_k.assign(self._gibbs_k_value)
+            num_steps = self.gibbs_k
+        else:
+            num_steps = self.gibbs_sampling_steps
+
+        self._data_rows = tf.placeholder(
+            self.dtype, [self.batch_size, n_features], name='data-rows')
+        seed_ops = []
+
+        if self.visible_unit_type == 'rsm':
+            self.doc_lengths_ = tf.Variable(
+                tf.zeros([self.batch_size], dtype=self.dtype),
+                trainable=False, name='doc-lengths')
+            seed_ops.append(self.doc_lengths_.assign(
+                tfutils.input_reduce_sum(self._data_rows, 1)))
+
+        if self.persistent_cd:
+            # replaced by training rows before the first step
+            self.chain = tf.Variable(
+                tf.zeros([self.batch_size, n_features], dtype=self.dtype),
+                trainable=False, name='persistent-chain')
+            seed_ops.append(self.chain.assign(self._data_rows))
+            vprob, vstate = self._gibbs_chain(
+                self.chain, num_steps, n_features, sample_states=True)
+            self.chain_upd8 = self.chain.assign(vstate)
 
-        negative = tf.matmul(tf.transpose(vprob), hprob1)
+        else:
+            # the first step of the chain started from the batch
+            vprob, vstate = self._gibbs_chain(
+                vprob, num_steps - 1, n_features)
+
+        self._seed_from_data = tf.group(*seed_ops) if seed_ops else None
+
+        hprob1 = self.sample_hidden_from_visible(vprob)[0]
+
+        negative = tfutils.matmul_acc(vprob, hprob1, transpose_a=True)
+        bv_scale = 1.
+
+        if self.visible_unit_type == 'gauss':
+            negative = tf.div(negative, tf.expand_dims(self.sigma, 1))
+            bv_scale = tf.exp(2. * self.log_sigma)
+
+            if self.learn_sigma:
+                # gradient of the log-likelihood w.r.t. log sigma, i.e. of
+                # the difference of the free energies of data and samples
+                free_energy_diff = tf.sub(
+                    tfutils.reduce_mean_acc(self.free_energy_node, 0),
+                    tfutils.reduce_mean_acc(self._create_free_energy_node(
+                        tf.stop_gradient(vprob)), 0))
+                self.sigma_upd8 = self.log_sigma.assign_sub(
+                    self.learning_rate *
+                    tf.gradients(free_energy_diff, self.log_sigma)[0])
+
+        if self.visible_unit_type == 'rsm':
+            # the hidden biases are shared by all the words of a document
+            hprob0 = tf.mul(hprob0, self.doc_length)
+            hprob1 = tf.mul(hprob1, self._doc_length(vprob))
+
+        # the statistics are accumulated in float32 and the float32 master
+        # parameters are updated
+        def to_float32(x):
+            return tf.cast(x, tf.float32)
 
         self.w_upd8 = self.W.assign_add(
-            self.learning_rate * (positive - negative) / self.batch_size)
+            self.learning_rate *
+            tf.sub(to_float32(positive), to_float32(negative)) /
+            self.batch_size)
 
+        # the means are taken separately, the persistent chain can have more
+        # rows than the last batch of the epoch
         self.bh_upd8 = self.bh_.assign_add(tf.mul(
-            self.learning_rate, tf.reduce_mean(tf.sub(hprob0, hprob1), 0)))
+            self.learning_rate,
+            tf.sub(to_float32(tfutils.reduce_mean_acc(hprob0, 0)),
+                   to_float32(tfutils.reduce_mean_acc(hprob1, 0)))))
 
         self.bv_upd8 = self.bv_.assign_add(tf.mul(
-            self.learning_rate, tf.reduce_mean(
-                tf.sub(self.input_data, vprob), 0)))
+            self.learning_rate,
+            tf.sub(to_float32(tfutils.input_reduce_mean_acc(
+                       self.input_data, 0)),
+                   to_float32(tfutils.reduce_mean_acc(vprob, 0))) /
+            bv_scale))
 
         vars = [self.W, self.bh_, self.bv_]
         regterm = self.compute_regularization(vars)
 
-        self._create_cost_function_node(vprob, self.input_data,
-                                        regterm=regterm)
+        self._create_cost_function_node(
+            recon_vprob, tfutils.input_to_dense(self.input_data),
+            regterm=regterm)
 
     def _create_placeholders(self, n_features):
         """Create the TensorFlow placeholders for the model.
@@ -155,12 +364,32 @@ class RBM(UnsupervisedModel):
         :param n_features: number of features
         :return: self
         """
-        self.input_data = tf.placeholder(tf.float32, [None, n_features],
-                                         name='x-input')
-        self.hrand = tf.placeholder(tf.float32, [None, self.num_hidden],
-                                    name='hrand')
-        self.vrand = tf.placeholder(tf.float32, [None, n_features],
-                                    name='vrand')
+        if self.data_pipeline is not None:
+            # training batches are gathered in-graph, they are fed only for
+            # validation and inference
+            self.input_data = tf.placeholder_with_default(
+                tf.cast(self.data_pipeline.batches[0], self.dtype),
+                [None, n_features], name='x-input')
+        else:
+            self.input_data = tfutils.input_placeholder(
+                n_features, self.sparse_input, dtype=self.dtype)
+
+        if self.in_graph_rng or self.data_pipeline is not None:
+            # random values are generated in-graph, unless they are fed
+            batch_size = tfutils.input_num_rows(self.input_data)
+            self.hrand = tf.placeholder_with_default(
+                tf.random_uniform(tf.pack([batch_size, self.num_hidden]),
+                                  dtype=self.dtype),
+                [None, self.num_hidden], name='hrand')
+            self.vrand = tf.placeholder_with_default(
+                tf.random_uniform(tf.pack([batch_size, n_features]),
+                                  dtype=self.dtype),
+                [None, n_features], name='vrand')
+        else:
+            self.hrand = tf.placeholder(
+                self.dtype, [None, self.num_hidden], name='hrand')
+            self.vrand = tf.placeholder(
+                self.dtype, [None, n_features], name='vrand')
         # not used in this model, created just to comply with
         # unsupervised_model.py
         self.input_labels = tf.placeholder(tf.float32)
@@ -173,11 +402,97 @@ class RBM(UnsupervisedModel):
         :return: self
         """
         self.W = tf.Variable(tf.truncated_normal(
-            shape=[n_features, self.num_hidden], stddev=0.1), name='weights')
-        self.bh_ = tf.Variable(tf.constant(0.1, shape=[self.num_hidden]),
-                               name='hidden-bias')
-        self.bv_ = tf.Variable(tf.constant(0.1, shape=[n_features]),
-                               name='visible-bias')
+            shape=[n_features, self.num_hidden], stddev=0.1),
+            name='weights')
+        self.bh_ = tf.Variable(tf.constant(
+            0.1, shape=[self.num_hidden]), name='hidden-bias')
+        self.bv_ = tf.Variable(tf.constant(
+            0.1, shape=[n_features]), name='visible-bias')
+
+        self._W = tf.cast(self.W, self.dtype)
+        self._bh = tf.cast(self.bh_, self.dtype)
+        self._bv = tf.cast(self.bv_, self.dtype)
+
+        if self.visible_unit_type == 'gauss':
+            self.log_sigma = tf.Variable(
+                tf.constant(np.log(self.stddev), shape=[n_features],
+                            dtype=tf.float32),
+                trainable=self.learn_sigma, name='visible-log-sigma')
+            self.sigma = tf.cast(tf.exp(self.log_sigma), self.dtype)
+
+    def _create_free_energy_node(self, visible):
+        """Create the free energy of each row of visible.
+
+        :param visible: visible units. shape(n_samples, n_features)
+        :return: free energies. shape(n_samples,)
+        """
+        hidden_term = tfutils.input_reduce_sum(tf.nn.softplus(
+            self._hidden_activation(visible)), 1)
+
+        if self.visible_unit_type == 'gauss':
+            visible_term = tfutils.input_reduce_sum(tf.square(tf.div(tf.sub(
+                tfutils.input_to_dense(visible), self._bv),
+                self.sigma)), 1) / 2
+        else:
+            visible_term = -tf.reshape(tfutils.input_matmul(
+                visible, tf.expand_dims(self._bv, 1)), [-1])
+
+        return tf.sub(visible_term, hidden_term)
+
+    def _gibbs_chain(self, visible, num_steps, n_features,
+                     sample_states=False, loop=None):
+        """Run num_steps steps of the gibbs chain starting from visible.
+
+        The steps are unrolled in the graph, unless gibbs_loop is True: then
+        the chain is a tf.while_loop, num_steps can be a tensor and the size
+        of the graph does not depend on it.
+        :param visible: initial state of the visible units
+        :param num_steps: number of steps, int or int32 tensor
+        :param n_features: number of features
+        :param sample_states: if True, the hidden and binary visible states
+            are sampled at each step with random values generated in-graph
+            (persistent chain), otherwise the chain moves through the
+            visible probabilities as the contrastive divergence steps.
+            optional, default False
+        :param loop: whether to use a tf.while_loop, default gibbs_loop
+        :return: tuple(visible probs, visible states) of the last step
+        """
+        def step(vprobs, vstates):
+            if not sample_states:
+                hprobs, _ = self.sample_hidden_from_visible(vstates)
+                vprobs, _ = self.sample_visible_from_hidden(
+                    hprobs, n_features, self._doc_length(vstates))
+                return vprobs, vprobs
+
+            hrand = tf.random_uniform(
+                tf.pack([tf.shape(vstates)[0], self.num_hidden]),
+                dtype=self.dtype)
+            _, hstates = self.sample_hidden_from_visible(vstates, hrand)
+            vprobs, counts = self.sample_visible_from_hidden(
+                hstates, n_features, self._doc_length(vstates))
+            if self.visible_unit_type == 'bin':
+                vstates = utilities.sample_prob(
+                    vprobs, tf.random_uniform(tf.shape(vprobs),
+                                              dtype=self.dtype))
+                return vprobs, vstates
+            if self.visible_unit_type == 'rsm':
+                return vprobs, counts
+            return vprobs, vprobs
+
+        if loop is None:
+            loop = self.gibbs_loop
+
+        if not loop:
+            vprobs = vstates = visible
+            for _ in range(num_steps):
+                vprobs, vstates = step(vprobs, vstates)
+            return vprobs, vstates
+
+        _, vprobs, vstates = tf.while_loop(
+            lambda i, vprobs, vstates: i < num_steps,
+            lambda i, vprobs, vstates: (i + 1,) + step(vprobs, vstates),
+            [tf.constant(0), visible, visible])
+        return vprobs, vstates
 
     def gibbs_sampling_step(self, visible, n_features):
         """Perform one step of gibbs sampling.
@@ -188,50 +503,116 @@ class RBM(UnsupervisedModel):
                        new hidden probs, new hidden states)
         """
         hprobs, hstates = self.sample_hidden_from_visible(visible)
-        vprobs, vstates = self.sample_visible_from_hidden(hprobs, n_features)
+        vprobs, vstates = self.sample_visible_from_hidden(
+            hprobs, n_features, self._doc_length(visible))
         hprobs1, hstates1 = self.sample_hidden_from_visible(vprobs)
 
         return hprobs, hstates, vprobs, vstates, hprobs1, hstates1
 
-    def sample_hidden_from_visible(self, visible):
+    def sample_hidden_from_visible(self, visible, hrand=None):
         """Sample the hidden units from the visible units.
 
         This is the Positive phase of the Contrastive Divergence algorithm.
 
         :param visible: activations of the visible units
+        :param hrand: uniform random values used to sample the hidden
+            states. optional, default None, i.e. self.hrand
         :return: tuple(hidden probabilities, hidden binary states)
         """
-        hprobs = tf.nn.sigmoid(tf.add(tf.matmul(visible, self.W), self.bh_))
-        hstates = utilities.sample_prob(hprobs, self.hrand)
+        if hrand is None:
+            hrand = self.hrand
+        hprobs = tf.nn.sigmoid(self._hidden_activation(visible))
+        hstates = utilities.sample_prob(hprobs, hrand)
 
         return hprobs, hstates
 
-    def sample_visible_from_hidden(self, hidden, n_features):
+    def _hidden_activation(self, visible):
+        """Input of the hidden units, visible can be a tf.SparseTensor.
+
+        With replicated softmax visible units the hidden biases are scaled
+        by the length of each document.
+        :param visible: visible units. shape(n_samples, n_features)
+        :return: hidden activations. shape(n_samples, num_hidden)
+        """
+        W, bias = self._W, self._bh
+        if self.visible_unit_type == 'gauss':
+            # the input is visible / sigma
+            W = tf.div(W, tf.expand_dims(self.sigma, 1))
+        elif self.visible_unit_type == 'rsm':
+            bias = tf.mul(self._doc_length(visible), self._bh)
+        return tf.add(tfutils.input_matmul(visible, W), bias)
+
+    def _doc_length(self, visible):
+        """Length of each document, if visible_unit_type is 'rsm'.
+
+        :param visible: visible word counts. shape(n_samples, n_features)
+        :return: total counts. shape(n_samples, 1), None for other units
+        """
+        if self.visible_unit_type != 'rsm':
+            return None
+        return tfutils.input_reduce_sum(visible, 1, keep_dims=True)
+
+    def _sample_counts(self, logits, doc_length, n_features):
+        """Sample the word counts of replicated softmax visible units.
+
+        Each row draws as many words as the longest document of the batch
+        in a single multinomial op, the draws beyond the length of the
+        document are masked out and the rest are counted per word.
+        :param logits: visible activations. shape(n_samples, n_features)
+        :param doc_length: length of each document. shape(n_samples, 1)
+        :param n_features: number of features
+        :return: word counts. shape(n_samples, n_features)
+        """
+        num_rows = tf.shape(logits)[0]
+        lengths = tf.to_int32(tf.round(doc_length))
+        max_length = tf.reduce_max(lengths)
+
+        words = tf.to_int32(tf.multinomial(
+            tf.cast(logits, tf.float32), max_length))
+        valid = tf.to_float(tf.less(tf.range(max_length), lengths))
+        ids = words + tf.expand_dims(tf.range(num_rows) * n_features, 1)
+
+        counts = tf.unsorted_segment_sum(
+            tf.reshape(valid, [-1]), tf.reshape(ids, [-1]),
+            num_rows * n_features)
+        return tf.cast(tf.reshape(counts, tf.pack([num_rows, n_features])),
+                       self.dtype)
+
+    def sample_visible_from_hidden(self, hidden, n_features,
+                                   doc_length=None):
         """Sample the visible units from the hidden units.
 
         This is the Negative phase of the Contrastive Divergence algorithm.
         :param hidden: activations of the hidden units
         :param n_features: number of features
+        :param doc_length: length of each document, used if
+            visible_unit_type is 'rsm'. optional, default None, i.e. the
+            length of the input documents
         :return: visible probabilities
         """
-        visible_activation = tf.add(
-            tf.matmul(hidden, tf.transpose(self.W)),
-            self.bv_
-        )
+        hidden_input = tfutils.matmul_acc(hidden, self._W, transpose_b=True)
+        visible_activation = tf.add(hidden_input, self._bv)
 
         if self.visible_unit_type == 'bin':
             vprobs = tf.nn.sigmoid(visible_activation)
             vstates = None
 
         elif self.visible_unit_type == 'gauss':
-            vprobs = tf.truncated_normal(
-                (1, n_features), mean=visible_activation, stddev=self.stddev)
+            # mean bv + sigma * W.h, sampled by reparameterization
+            vprobs = tf.add(self._bv, tf.mul(self.sigma, hidden_input))
+            if not self.gauss_mean_field:
+                vprobs = tf.add(vprobs, tf.mul(
+                    self.sigma, tf.random_normal(tf.shape(vprobs),
+                                                 dtype=self.dtype)))
             vstates = None
 
         elif self.visible_unit_type == 'rsm':
-            vprobs = tf.nn.softmax(visible_activation)
-            # self.D = input.sum(axis=1)
-            vstates = tf.multinomial(vprobs, 1)  # self.D)  # document size
+            if doc_length is None:
+                doc_length = self.doc_length
+            # expected counts, the chain keeps the length of the documents
+            vprobs = tf.mul(tf.nn.softmax(visible_activation), doc_length)
+            vstates = self._sample_counts(
+                visible_activation, doc_length, n_features)
 
         else:
             vprobs = None
@@ -249,13 +630,17 @@ class RBM(UnsupervisedModel):
         :return: positive association = dot(visible.T, hidden)
         """
         if self.visible_unit_type == 'bin':
-            positive = tf.matmul(tf.transpose(visible), hidden_states)
+            positive = tfutils.input_matmul(
+                visible, hidden_states, transpose_x=True)
 
         elif self.visible_unit_type == 'gauss':
-            positive = tf.matmul(tf.transpose(visible), hidden_probs)
+            positive = tf.div(tfutils.input_matmul(
+                visible, hidden_probs, transpose_x=True),
+                tf.expand_dims(self.sigma, 1))
 
         elif self.visible_unit_type == 'rsm':
-            positive = tf.matmul(tf.transpose(visible), hidden_states)
+            positive = tfutils.input_matmul(
+                visible, hidden_states, transpose_x=True)
 
         else:
             positive = None
@@ -291,14 +676,169 @@ class RBM(UnsupervisedModel):
         :param graph: tf graph object
         :return: model parameters
         """
-        g = graph if graph is not None else self.tf_graph
-
-        with g.as_default():
-            with tf.Session() as self.tf_session:
-                self.tf_saver.restore(self.tf_session, self.model_path)
-
-                return {
-                    'W': self.W.eval(),
-                    'bh_': self.bh_.eval(),
-                    'bv_': self.bv_.eval()
-                }
+        with self._restored_session(graph) as sess:
+            W, bh_, bv_ = sess.run([self.W, self.bh_, self.bv_])
+            params = {'W': W, 'bh_': bh_, 'bv_': bv_}
+            if self.log_sigma is not None:
+                params['sigma'] = np.exp(sess.run(self.log_sigma))
+            return params
+
+    def get_encoding_parameters(self, graph=None):
+        """Return the weights and biases of transform as a dense layer.
+
+        transform computes sigmoid(visible . W + bh), with gaussian visible
+        units the input is visible / sigma, so W is divided by sigma.
+        :param graph: tf graph object
+        :return: tuple(weights. shape(n_features, num_hidden), biases)
+        """
+        params = self.get_parameters(graph=graph)
+        W = params['W']
+        if 'sigma' in params:
+            W = W / params['sigma'][:, None]
+        return W, params['bh_']
+
+    def free_energy(self, data, graph=None, batch_size=1000):
+        """Compute the free energy of each sample of data.
+
+        The data is processed batch_size rows at a time, so that it can be
+        a memory-mapped array of any size.
+        :param data: data to score. shape(n_samples, n_features)
+        :param graph: tf graph object
+        :param batch_size: number of rows evaluated at each step
+        :return: free energies. shape(n_samples,)
+        """
+        batches = self._gen_eval_batches(
+            self.free_energy_node, data, batch_size, graph=graph)
+        return self._fill_from_batches(batches, data.shape[0],
+                                       node=self.free_energy_node)
+
+    def score_samples(self, data, log_z=0., graph=None, batch_size=1000):
+        """Compute the log-likelihood of each sample of data.
+
+        Without log_z the scores are unnormalized (minus the free energy),
+        which is enough to rank samples, e.g. for anomaly detection.
+        :param data: data to score. shape(n_samples, n_features)
+        :param log_z: log partition function, see `estimate_log_partition`.
+            optional, default 0
+        :param graph: tf graph object
+        :param batch_size: number of rows evaluated at each step
+        :return: log-likelihoods. shape(n_samples,)
+        """
+        return -self.free_energy(data, graph, batch_size) - log_z
+
+    def sample(self, n, k_steps=1, burn_in=1000, num_chains=100,
+               graph=None, out_path=None, init=None, rng=None):
+        """Draw samples of the visible units from the model.
+
+        num_chains persistent gibbs chains are run in parallel in a single
+        session. After burn_in steps, every k_steps steps the state of all
+        the chains is taken as a batch of samples.
+        :param n: number of samples
+        :param k_steps: number of gibbs steps between samples of a chain
+        :param burn_in: number of gibbs steps before the first sample
+        :param num_chains: number of parallel chains
+        :param graph: tf graph object
+        :param out_path: optional, path of a .npy file the samples are
+            written to batch by batch. If None, the samples are returned as
+            an in-memory array
+        :param init: optional, initial state of the chains.
+            shape(num_chains, n_features). Default uniform random binary or,
+            with 'rsm' visible units, uniform random words with the lengths
+            of training documents
+        :param rng: numpy random number generator for the initial state
+        :return: samples. shape(n, n_features), memory-mapped read-only if
+            out_path is given
+        """
+        batches = self.sample_batches(
+            n, k_steps, burn_in, num_chains, graph, init, rng)
+        if out_path is None:
+            return self._fill_from_batches(batches, n,
+                                           node=self.sample_start)
+
+        n_features = self.sample_start.get_shape()[1].value
+        out = np.lib.format.open_memmap(
+            out_path, mode='w+', dtype=np.float32, shape=(n, n_features))
+        self._fill_from_batches(batches, n, out)
+        out.flush()
+        del out
+
+        return np.load(out_path, mmap_mode='r')
+
+    def sample_batches(self, n, k_steps=1, burn_in=1000, num_chains=100,
+                       graph=None, init=None, rng=None):
+        """Draw samples of the visible units, one batch at a time.
+
+        See `sample`.
+        :return: generator of arrays of at most num_chains samples
+        """
+        rng = np.random if rng is None else rng
+
+        with self._restored_session(graph) as sess:
+            if init is None:
+                n_features = self.sample_start.get_shape()[1].value
+                if self.visible_unit_type == 'rsm':
+                    lengths = rng.choice(
+                        sess.run(self.doc_lengths_), num_chains)
+                    init = [rng.multinomial(int(round(length)),
+                                            np.ones(n_features) / n_features)
+                            for length in lengths]
+                else:
+                    init = (rng.random((num_chains, n_features)) < 0.5)
+            states = np.asarray(init, dtype=np.float32)
+
+            steps = burn_in
+            for i in range(0, n, states.shape[0]):
+                states = sess.run(self.sample_states,
+                                  {self.sample_start: states,
+                                   self.sample_steps: steps})
+                steps = k_steps
+                yield states[:n - i]
+
+    def estimate_log_partition(self, num_chains=100, betas=None,
+                               num_betas=1000, base_data=None, graph=None,
+                               rng=None):
+        """Estimate the log partition function Z with AIS.
+
+        Only binary visible units are supported.
+        See `yadlt.utils.utilities.rbm_ais_log_partition`.
+        :param num_chains: number of AIS chains, run as one batch
+        :param betas: increasing inverse temperatures from 0 to 1,
+            default num_betas evenly spaced values
+        :param num_betas: number of inverse temperatures if betas is None
+        :param base_data: optional, data (e.g. the training set) used to
+            set the visible bias of the base rbm
+        :param graph: tf graph object
+        :param rng: numpy random number generator
+        :return: estimated log Z
+        """
+        if self.visible_unit_type != 'bin':
+            raise Exception('AIS is implemented only for binary visible units')
+
+        params = self.get_parameters(graph=graph)
+        log_z, _ = utilities.rbm_ais_log_partition(
+            params['W'], params['bh_'], params['bv_'], betas=betas,
+            num_betas=num_betas, num_chains=num_chains, base_data=base_data,
+            rng=rng)
+        return log_z
+
+    def average_log_likelihood(self, data, log_z=None, graph=None,
+                               batch_size=1000, **ais_params):
+        """Compute the average log-likelihood of data.
+
+        :param data: binary data. shape(n_samples, n_features)
+        :param log_z: log partition function of the model. If None, it is
+            estimated with `estimate_log_partition(**ais_params)`
+        :param graph: tf graph object
+        :param batch_size: number of rows of data processed at a time
+        :return: mean of log p(v) over data
+        """
+        if log_z is None:
+            log_z = self.estimate_log_partition(graph=graph, **ais_params)
+
+        params = self.get_parameters(graph=graph)
+        total = 0.
+        for i in range(0, data.shape[0], batch_size):
+            total += utilities.rbm_free_energy(
+                data[i:i + batch_size], params['W'], params['bh_'],
+                params['bv_']).sum()
+        return -total / data.shape[0] - log_z
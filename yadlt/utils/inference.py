@@ -0,0 +1,213 @@
+"""NumPy inference of exported dense networks.
+
+This module does not import tensorflow, so that trained models can be
+served by processes that only have numpy installed.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+# activation functions by name, the names match the tf.nn functions
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'softmax': _softmax,
+}
+
+
+def quantize_per_channel(W):
+    """Quantize a weight matrix to int8 with one scale per output channel.
+
+    :param W: weights. shape(n_in, n_out)
+    :return: tuple(int8 weights, float32 scales. shape(n_out,)), such that
+        W is approximately q * scales
+    """
+    W = np.asarray(W, dtype=np.float32)
+    scales = np.abs(W).max(axis=0) / 127.
+    scales[scales == 0] = 1.
+    q = np.clip(np.round(W / scales), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+class DenseNetwork(object):
+    """Stack of dense layers evaluated with numpy.
+
+    The network is built from the parameters exported by the save method
+    of the models, and it runs batched inference without tensorflow.
+    """
+
+    def __init__(self, weights, biases, activations):
+        """Constructor.
+
+        :param weights: list of weight matrices, one per layer
+        :param biases: list of biases, one per layer
+        :param activations: list of activation names, one per layer,
+            see `ACTIVATIONS`
+        """
+        for act in activations:
+            if act not in ACTIVATIONS:
+                raise Exception('Unknown activation function: %s' % act)
+
+        self.weights = weights
+        self.biases = biases
+        self.activations = activations
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the parameters."""
+        return sum(a.nbytes for a in self.weights + self.biases)
+
+    def _linear(self, x, l):
+        """Linear output of layer l for the batch x, before activation."""
+        # x.dot also accepts scipy sparse matrices
+        return x.dot(self.weights[l]) + self.biases[l]
+
+    def forward(self, data, batch_size=None):
+        """Compute the output of the last layer.
+
+        :param data: input data, array or scipy sparse matrix.
+            shape(n_samples, n_features)
+        :param batch_size: optional, default None. If not None, data is
+            processed batch_size rows at a time
+        :return: output. shape(n_samples, n_out)
+        """
+        batch_size = batch_size or data.shape[0]
+
+        out = None
+        for i in range(0, data.shape[0], batch_size):
+            x = data[i:i + batch_size]
+            for l, act in enumerate(self.activations):
+                x = ACTIVATIONS[act](self._linear(x, l))
+            if out is None:
+                out = np.empty((data.shape[0], x.shape[1]), dtype=x.dtype)
+            out[i:i + x.shape[0]] = x
+        return out
+
+    def predict(self, data, batch_size=None):
+        """Predict the class of each sample of data.
+
+        :param data: input data. shape(n_samples, n_features)
+        :param batch_size: number of rows processed at a time
+        :return: class indices. shape(n_samples,)
+        """
+        return np.argmax(self.forward(data, batch_size), 1)
+
+    def _arrays(self):
+        """Return the dict of arrays written by save."""
+        arrays = {'activations': np.array(self.activations)}
+        for l, (W, b) in enumerate(zip(self.weights, self.biases)):
+            arrays['W_%d' % l] = W
+            arrays['b_%d' % l] = b
+        return arrays
+
+    def save(self, path):
+        """Save the network to a .npz file.
+
+        :param path: file path
+        :return: self
+        """
+        np.savez(path, **self._arrays())
+        return self
+
+    @classmethod
+    def _from_arrays(cls, f, n_layers):
+        """Return the constructor arguments read from a .npz file."""
+        return dict(weights=[f['W_%d' % l] for l in range(n_layers)],
+                    biases=[f['b_%d' % l] for l in range(n_layers)])
+
+    @classmethod
+    def load(cls, path):
+        """Load a network saved with `save`.
+
+        :param path: file path
+        :return: network of this class
+        """
+        with np.load(path) as f:
+            activations = [str(a) for a in f['activations']]
+            return cls(activations=activations,
+                       **cls._from_arrays(f, len(activations)))
+
+
+class QuantizedNetwork(DenseNetwork):
+    """Dense network with int8 weights and per-channel scales.
+
+    numpy has no int8 matrix product, so each layer multiplies the input
+    by the int8 weights converted to float32 and applies the per-channel
+    scales to the product, which is equivalent to using the dequantized
+    weights. The weights are converted chunk_size output columns at a
+    time, so that the network takes about a quarter of the float32 memory
+    also while it runs. The conversion makes the forward pass slower than
+    the one of the float network.
+    """
+
+    # number of output columns of int8 weights converted at a time
+    chunk_size = 256
+
+    def __init__(self, weights, scales, biases, activations):
+        """Constructor.
+
+        :param weights: list of int8 weight matrices, one per layer
+        :param scales: list of float32 per-channel scales, one per layer
+        :param biases: list of float32 biases, one per layer
+        :param activations: list of activation names, one per layer,
+            see `ACTIVATIONS`
+        """
+        DenseNetwork.__init__(self, weights, biases, activations)
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, weights, biases, activations):
+        """Quantize the float weights of a dense network.
+
+        :param weights: list of float weight matrices, one per layer
+        :param biases: list of biases, one per layer
+        :param activations: list of activation names, one per layer
+        :return: QuantizedNetwork
+        """
+        quantized = [quantize_per_channel(W) for W in weights]
+        return cls([q for q, _ in quantized], [s for _, s in quantized],
+                   [np.asarray(b, dtype=np.float32) for b in biases],
+                   list(activations))
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the parameters."""
+        return DenseNetwork.nbytes.fget(self) + sum(
+            s.nbytes for s in self.scales)
+
+    def _linear(self, x, l):
+        q = self.weights[l]
+        out = np.empty((x.shape[0], q.shape[1]), dtype=np.float32)
+        for j in range(0, q.shape[1], self.chunk_size):
+            cols = slice(j, j + self.chunk_size)
+            out[:, cols] = x.dot(q[:, cols].astype(np.float32))
+        out *= self.scales[l]
+        out += self.biases[l]
+        return out
+
+    def _arrays(self):
+        arrays = DenseNetwork._arrays(self)
+        for l, s in enumerate(self.scales):
+            arrays['scale_%d' % l] = s
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, f, n_layers):
+        arrays = super(QuantizedNetwork, cls)._from_arrays(f, n_layers)
+        arrays['scales'] = [f['scale_%d' % l] for l in range(n_layers)]
+        return arrays
@@ -1,6 +1,8 @@
 """Collection of Tensorflow specific utilities."""
 
+import numpy as np
 import os
+from scipy import sparse
 import tensorflow as tf
 
 from ..core.config import Config
@@ -45,3 +47,317 @@ def init_tf_ops(sess):
     summary_writer = tf.summary.FileWriter(run_dir, sess.graph)
 
     return (summary_merged, summary_writer)
+
+
+def feed_value(data):
+    """Convert data to a value that can be fed to an input placeholder.
+
+    Scipy sparse matrices are converted to `tf.SparseTensorValue`, to be fed
+    to a `tf.sparse_placeholder`, other data is returned unchanged.
+
+    Parameters
+    ----------
+
+    data : array_like or scipy.sparse matrix
+        Input data.
+
+    Returns
+    -------
+
+    data or tf.SparseTensorValue
+    """
+    if not sparse.issparse(data):
+        return data
+
+    coo = data.tocoo()
+    indices = np.column_stack((coo.row, coo.col)).astype(np.int64)
+    return tf.SparseTensorValue(
+        indices, coo.data.astype(np.float32), np.array(coo.shape, np.int64))
+
+
+def input_placeholder(n_features, sparse_input=False, name='x-input',
+                      dtype=tf.float32):
+    """Create the placeholder of the input data of a model.
+
+    Parameters
+    ----------
+
+    n_features : int
+        Number of features.
+
+    sparse_input : bool, optional (default = False)
+        If True, a `tf.sparse_placeholder` fed with scipy sparse batches
+        through `feed_value`.
+
+    name : str, optional (default = 'x-input')
+        Name of the placeholder.
+
+    dtype : tf.DType, optional (default = tf.float32)
+        Type of the input, the fed data is converted to it.
+
+    Returns
+    -------
+
+    tf.Tensor or tf.SparseTensor
+    """
+    if sparse_input:
+        return tf.sparse_placeholder(dtype, name=name)
+    return tf.placeholder(dtype, [None, n_features], name=name)
+
+
+def matmul_acc(a, b, **kwargs):
+    """Matrix product accumulated in float32 for half precision tensors.
+
+    float16 operands are stored in half precision but their product is
+    computed in float32 and cast back, so that the sums over long inner
+    dimensions do not lose precision.
+
+    Parameters
+    ----------
+
+    a, b : tf.Tensor
+        Operands of `tf.matmul`.
+
+    kwargs : dict
+        Other arguments of `tf.matmul`.
+
+    Returns
+    -------
+
+    tf.Tensor : product, with the dtype of a
+    """
+    if a.dtype.base_dtype != tf.float16:
+        return tf.matmul(a, b, **kwargs)
+    return tf.cast(tf.matmul(tf.cast(a, tf.float32), tf.cast(b, tf.float32),
+                             **kwargs), tf.float16)
+
+
+def reduce_mean_acc(x, axis):
+    """Mean along axis accumulated in float32 for half precision tensors.
+
+    Parameters
+    ----------
+
+    x : tf.Tensor
+        Input tensor.
+
+    axis : int
+        Axis to average over.
+
+    Returns
+    -------
+
+    tf.Tensor : mean, with the dtype of x
+    """
+    if x.dtype.base_dtype != tf.float16:
+        return tf.reduce_mean(x, axis)
+    return tf.cast(tf.reduce_mean(tf.cast(x, tf.float32), axis), tf.float16)
+
+
+def _to_float32(x):
+    """Cast a float16 tensor, dense or sparse, to float32."""
+    if x.dtype.base_dtype != tf.float16:
+        return x
+    if isinstance(x, tf.SparseTensor):
+        return tf.SparseTensor(x.indices, tf.cast(x.values, tf.float32),
+                               x.shape)
+    return tf.cast(x, tf.float32)
+
+
+def input_matmul(x, W, transpose_x=False):
+    """Matrix product of an input tensor, dense or sparse, by W.
+
+    Parameters
+    ----------
+
+    x : tf.Tensor or tf.SparseTensor
+        Input tensor, shape (n_samples, n_features).
+
+    W : tf.Tensor
+        Weights, shape (n_features, n_out), or (n_samples, n_out) if
+        transpose_x is True.
+
+    transpose_x : bool, optional (default = False)
+        Whether to multiply by the transpose of x.
+
+    Returns
+    -------
+
+    tf.Tensor : dense product, accumulated in float32 if x is float16
+    """
+    if not isinstance(x, tf.SparseTensor):
+        return matmul_acc(x, W, transpose_a=transpose_x)
+
+    if x.dtype.base_dtype != tf.float16:
+        return tf.sparse_tensor_dense_matmul(x, W, adjoint_a=transpose_x)
+    return tf.cast(tf.sparse_tensor_dense_matmul(
+        _to_float32(x), tf.cast(W, tf.float32), adjoint_a=transpose_x),
+        tf.float16)
+
+
+def input_reduce_sum(x, axis, keep_dims=False):
+    """Sum of an input tensor, dense or sparse, along axis.
+
+    Parameters
+    ----------
+
+    x : tf.Tensor or tf.SparseTensor
+        Input tensor.
+
+    axis : int
+        Axis to sum over.
+
+    keep_dims : bool, optional (default = False)
+        Whether to keep the reduced dimension.
+
+    Returns
+    -------
+
+    tf.Tensor : dense sum, accumulated in float32 if x is float16
+    """
+    if isinstance(x, tf.SparseTensor):
+        total = tf.sparse_reduce_sum
+    else:
+        total = tf.reduce_sum
+
+    if x.dtype.base_dtype != tf.float16:
+        return total(x, axis, keep_dims=keep_dims)
+    return tf.cast(total(_to_float32(x), axis, keep_dims=keep_dims),
+                   tf.float16)
+
+
+def input_reduce_mean_acc(x, axis):
+    """Mean of an input tensor, dense or sparse, accumulated in float32.
+
+    Parameters
+    ----------
+
+    x : tf.Tensor or tf.SparseTensor
+        Input tensor.
+
+    axis : int
+        Axis to average over.
+
+    Returns
+    -------
+
+    tf.Tensor : dense mean, with the dtype of x
+    """
+    if not isinstance(x, tf.SparseTensor):
+        return reduce_mean_acc(x, axis)
+
+    x32 = _to_float32(x)
+    mean = tf.div(tf.sparse_reduce_sum(x32, axis),
+                  tf.cast(x.shape[axis], x32.dtype))
+    return tf.cast(mean, x.dtype)
+
+
+def input_num_rows(x):
+    """Number of rows of an input tensor, dense or sparse, as int32 tensor."""
+    if isinstance(x, tf.SparseTensor):
+        return tf.to_int32(x.shape[0])
+    return tf.shape(x)[0]
+
+
+def input_to_dense(x):
+    """Dense version of an input tensor, for ops without sparse kernels."""
+    if isinstance(x, tf.SparseTensor):
+        return tf.sparse_tensor_to_dense(x)
+    return x
+
+
+class InGraphData(object):
+    """Training data stored in the graph and batched by index.
+
+    The training arrays are loaded once into local variables, which are not
+    saved with the model. At each training step the next slice of a
+    per-epoch random permutation of the rows is gathered inside the graph,
+    so a training step is a single `session.run` with no feed dictionary.
+    """
+
+    def __init__(self, data, batch_size, name='in-graph-data'):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        data : list of array_like
+            Aligned training arrays, e.g. [train_set, train_labels].
+
+        batch_size : int
+            Size of each batch.
+
+        name : string, optional (default='in-graph-data')
+            Name scope of the pipeline ops.
+
+        Attributes
+        ----------
+
+        batches : list of tf.Tensor
+            Next training batch of each array in `data`. Evaluating these
+            tensors moves the pipeline forward by one step.
+        """
+        data = [np.asarray(d, dtype=np.float32) for d in data]
+        num_samples = data[0].shape[0]
+        self.batch_size = max(1, min(batch_size, num_samples))
+        self.steps_per_epoch = (num_samples - 1) // self.batch_size + 1
+        self.batches = []
+        self._init_feed = {}
+
+        local = [tf.GraphKeys.LOCAL_VARIABLES]
+
+        with tf.name_scope(name):
+            perm = tf.Variable(tf.range(num_samples), trainable=False,
+                               collections=local, name='perm')
+            step = tf.Variable(0, trainable=False, collections=local,
+                               name='step')
+            variables = [perm, step]
+
+            start = tf.mul(step.assign_add(1) - 1, self.batch_size)
+            size = tf.minimum(self.batch_size, num_samples - start)
+            idx = tf.slice(perm, tf.reshape(start, [1]), tf.reshape(size, [1]))
+
+            for d in data:
+                init = tf.placeholder(tf.float32, d.shape)
+                var = tf.Variable(init, trainable=False, collections=local)
+                self._init_feed[init] = d
+                self.batches.append(tf.gather(var, idx))
+                variables.append(var)
+
+            self.init_op = tf.variables_initializer(variables)
+            self.shuffle_op = tf.group(
+                perm.assign(tf.random_shuffle(tf.range(num_samples))),
+                step.assign(0))
+
+    def initialize(self, sess):
+        """Load the training data into the graph.
+
+        The host copy of the data is released afterwards, so the pipeline
+        can only be initialized once.
+
+        Parameters
+        ----------
+
+        sess : object
+            Tensorflow `Session` object
+        """
+        if self._init_feed is None:
+            raise Exception('The in-graph data is already initialized')
+        sess.run(self.init_op, feed_dict=self._init_feed)
+        self._init_feed = None
+
+    def run_epoch(self, sess, train_op):
+        """Shuffle the data and run `train_op` once for each batch.
+
+        Parameters
+        ----------
+
+        sess : object
+            Tensorflow `Session` object
+
+        train_op : tf node or list of tf nodes
+            Ops run at each training step, they must depend on `batches`.
+        """
+        sess.run(self.shuffle_op)
+        for _ in range(self.steps_per_epoch):
+            sess.run(train_op)
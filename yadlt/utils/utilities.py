@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import numpy as np
 from scipy import misc
+from scipy import sparse
 import tensorflow as tf
 
 # ################### #
@@ -37,22 +38,22 @@ def xavier_init(fan_in, fan_out, const=1):
     return tf.random_uniform((fan_in, fan_out), minval=low, maxval=high)
 
 
-def _corrupt_input(data, corr_type="none", corr_frac=0., sess=None):
+def _corrupt_input(data, corr_type="none", corr_frac=0., rng=None):
     """Corrupt a fraction of data according to the chosen noise method.
 
     :return: corrupted data
     """
-    corruption_ratio = np.round(corr_frac * data.shape[1]).astype(np.int)
+    corruption_ratio = int(np.round(corr_frac * data.shape[1]))
 
     if corr_type == 'none':
         return np.copy(data)
 
     if corr_frac > 0.0:
         if corr_type == 'masking':
-            return masking_noise(data, sess, corr_frac)
+            return masking_noise(data, corruption_ratio, rng=rng)
 
         elif corr_type == 'salt_and_pepper':
-            return salt_and_pepper_noise(data, corruption_ratio)
+            return salt_and_pepper_noise(data, corruption_ratio, rng=rng)
     else:
         return np.copy(data)
 
@@ -99,6 +100,58 @@ def gen_batches(data, batch_size):
         yield data[i:i + batch_size]
 
 
+def gen_minibatches(data, batch_size, shuffle=True, num_buffers=1):
+    """Divide aligned input arrays into minibatches.
+
+    A single permutation of the row indices is drawn and the rows of each
+    batch are gathered with `np.take` into preallocated float32 buffers, so
+    no per-row Python objects or per-batch allocations are made. The buffers
+    are reused: a batch stays valid until `num_buffers` more batches have
+    been generated.
+
+    Scipy sparse matrices are converted to CSR and their batches are CSR
+    matrices, gathered by row indexing instead of into the buffers. The
+    input arrays are never copied as a whole, only one batch at a time is
+    converted to float32.
+
+    :param data: list of arrays with the same number of rows
+    :param batch_size: size of each batch
+    :param shuffle: whether to visit the rows in random order
+    :param num_buffers: number of rotating buffers for each array
+    :return: generator of lists of arrays, one batch for each array in data
+    """
+    data = [d.tocsr() if sparse.issparse(d) else np.asarray(d) for d in data]
+    num_samples = data[0].shape[0]
+    batch_size = max(1, min(batch_size, num_samples))
+
+    def to_float32(batch):
+        return batch.astype(np.float32, copy=False)
+
+    def gather(d, idx, buf):
+        if buf is None:
+            return to_float32(d[idx])
+        out = buf[:len(idx)]
+        if d.dtype == np.float32:
+            return np.take(d, idx, axis=0, out=out, mode='clip')
+        out[...] = d[idx]
+        return out
+
+    if not shuffle:
+        for i in range(0, num_samples, batch_size):
+            yield [to_float32(d[i:i + batch_size]) for d in data]
+        return
+
+    perm = np.random.permutation(num_samples)
+    buffers = [[None if sparse.issparse(d) else
+                np.empty((batch_size,) + d.shape[1:], dtype=np.float32)
+                for d in data] for _ in range(num_buffers)]
+
+    for b, i in enumerate(range(0, num_samples, batch_size)):
+        idx = perm[i:i + batch_size]
+        yield [gather(d, idx, buf)
+               for d, buf in zip(data, buffers[b % num_buffers])]
+
+
 def to_one_hot(dataY):
     """Convert the vector of labels dataY into one-hot encoding.
 
@@ -112,98 +165,265 @@ def to_one_hot(dataY):
     return onehot
 
 
-def conv2bin(data):
+def conv2bin(data, dtype=None, rng=None, out=None):
     """Convert a matrix of probabilities into binary values.
 
     If the matrix has values <= 0 or >= 1, the values are
     normalized to be in [0, 1].
+    The matrix is processed in blocks of rows, so data and out can be
+    memory-mapped arrays larger than the available memory.
 
     :type data: numpy array
     :param data: input matrix
+    :param dtype: dtype of the output matrix, e.g. np.uint8 or np.bool_.
+        default data.dtype
+    :param rng: random number generator (np.random.Generator or
+        np.random.RandomState), default the global numpy generator
+    :param out: preallocated output matrix, default a new array
     :return: converted binary matrix
     """
-    if data.min() < 0 or data.max() > 1:
-        data = normalize(data)
-
-    out_data = data.copy()
+    rng = np.random if rng is None else rng
+    rescale = data.min() < 0 or data.max() > 1
 
-    for i, sample in enumerate(out_data):
+    if out is None:
+        dtype = data.dtype if dtype is None else dtype
+        out = np.empty(data.shape, dtype=dtype)
 
-        for j, val in enumerate(sample):
+    chunk = _chunk_rows(data.shape[1])
+    for i in range(0, data.shape[0], chunk):
+        block = data[i:i + chunk]
+        if rescale:
+            block = normalize(block)
+        out[i:i + chunk] = rng.random(block.shape) <= block
 
-            if np.random.random() <= val:
-                out_data[i][j] = 1
-            else:
-                out_data[i][j] = 0
+    return out
 
-    return out_data
 
-
-def normalize(data):
+def normalize(data, out=None):
     """Normalize the data to be in the [0, 1] range.
 
-    :param data:
+    Each sample is divided by the sum of its values. The matrix is processed
+    in blocks of rows, so data and out can be memory-mapped arrays.
+    :param data: input matrix
+    :param out: preallocated output matrix, default a new floating point
+        array
     :return: normalized data
     """
-    out_data = data.copy()
+    if out is None:
+        out = np.empty(data.shape, dtype=np.result_type(data, np.float32))
 
-    for i, sample in enumerate(out_data):
-        out_data[i] /= sum(out_data[i])
+    chunk = _chunk_rows(data.shape[1])
+    for i in range(0, data.shape[0], chunk):
+        block = np.asarray(data[i:i + chunk])
+        out[i:i + chunk] = block / block.sum(axis=1, keepdims=True)
 
-    return out_data
+    return out
 
 
-def masking_noise(data, sess, v):
+def masking_noise(data, v, rng=None, out=None):
     """Apply masking noise to data in X.
 
-    In other words a fraction v of elements of X
-    (chosen at random) is forced to zero.
-    :param data: array_like, Input data
-    :param sess: TensorFlow session
-    :param v: fraction of elements to distort, float
+    In other words v elements of each sample of X
+    (chosen at random) are forced to zero. v is a count, not a fraction:
+    for a corruption fraction use int(round(corr_frac * n_features)).
+    The noise is generated with numpy for blocks of samples at a time, so
+    no tensorflow op is added to the graph and the memory used does not
+    depend on the number of calls. Scipy sparse data is returned as a new
+    CSR matrix, see `_sparse_masking_noise`, and out is ignored.
+    :param data: array_like or scipy sparse matrix, Input data
+    :param v: int, number of elements to distort in each sample
+    :param rng: random number generator (np.random.Generator or
+        np.random.RandomState), default the global numpy generator
+    :param out: array where the result is stored, default a copy of data.
+        Pass data itself to apply the noise in-place
     :return: transformed data
     """
-    data_noise = data.copy()
-    rand = tf.random_uniform(data.shape)
-    data_noise[sess.run(tf.nn.relu(tf.sign(v - rand))).astype(np.bool)] = 0
+    rng = np.random if rng is None else rng
 
-    return data_noise
+    if sparse.issparse(data):
+        return _sparse_masking_noise(data, v, rng)
 
+    if out is None:
+        out = np.copy(data)
+    elif out is not data:
+        out[...] = data
 
-def salt_and_pepper_noise(X, v):
+    n_samples, n_features = data.shape
+    v = min(int(v), n_features)
+    if v <= 0:
+        return out
+
+    chunk = _chunk_rows(n_features)
+    for i in range(0, n_samples, chunk):
+        block = out[i:i + chunk]
+        rows = block.shape[0]
+        block[np.arange(rows)[:, None],
+              _random_columns(rng, rows, n_features, v)] = 0
+
+    return out
+
+
+def _sparse_masking_noise(data, v, rng):
+    """Masking noise of a scipy sparse matrix.
+
+    Masking a zero element leaves it unchanged, so each stored element is
+    masked with probability v / n_features, the probability that its column
+    is among the v masked columns of its row.
+    """
+    out = sparse.csr_matrix(data, copy=True)
+    out.data[rng.random(out.nnz) < v / out.shape[1]] = 0
+    out.eliminate_zeros()
+    return out
+
+
+def salt_and_pepper_noise(X, v, mn=None, mx=None, rng=None, out=None):
     """Apply salt and pepper noise to data in X.
 
-    In other words a fraction v of elements of X
-    (chosen at random) is set to its maximum or minimum value according to a
-    fair coin flip.
+    In other words v elements of each sample of X
+    (chosen at random) are set to the maximum or minimum value according to
+    a fair coin flip. v is a count, not a fraction: for a corruption
+    fraction use int(round(corr_frac * n_features)).
     If minimum or maximum are not given, the min (max) value in X is taken.
+    The noise is generated for blocks of samples at a time, without Python
+    loops over samples or elements.
     :param X: array_like, Input data
-    :param v: int, fraction of elements to distort
+    :param v: int, number of elements to distort in each sample
+    :param mn: value of the "pepper" elements, default X.min()
+    :param mx: value of the "salt" elements, default X.max()
+    :param rng: random number generator (np.random.Generator or
+        np.random.RandomState), default the global numpy generator
+    :param out: array where the result is stored, default a copy of X.
+        Pass X itself to apply the noise in-place
     :return: transformed data
     """
-    X_noise = X.copy()
-    n_features = X.shape[1]
+    rng = np.random if rng is None else rng
+    mn = X.min() if mn is None else mn
+    mx = X.max() if mx is None else mx
+
+    if out is None:
+        out = np.copy(X)
+    elif out is not X:
+        out[...] = X
+
+    n_samples, n_features = X.shape
+    v = min(int(v), n_features)
+    if v <= 0:
+        return out
 
-    mn = X.min()
-    mx = X.max()
+    chunk = _chunk_rows(n_features)
+    for i in range(0, n_samples, chunk):
+        block = out[i:i + chunk]
+        rows = block.shape[0]
+        mask = _random_columns(rng, rows, n_features, v)
+        noise = np.where(rng.random((rows, v)) < 0.5, mn, mx)
+        block[np.arange(rows)[:, None], mask] = noise
 
-    for i, sample in enumerate(X):
-        mask = np.random.randint(0, n_features, v)
+    return out
 
-        for m in mask:
 
-            if np.random.random() < 0.5:
-                X_noise[i][m] = mn
-            else:
-                X_noise[i][m] = mx
+def _random_columns(rng, rows, n_features, v):
+    """Draw v distinct random column indices for each of the rows.
 
-    return X_noise
+    :return: array of indices. shape(rows, v)
+    """
+    return np.argpartition(
+        rng.random((rows, n_features)), v - 1, axis=1)[:, :v]
+
+
+def _chunk_rows(n_features, max_elements=1 << 20):
+    """Number of rows processed at a time by the chunked data helpers.
+
+    :param n_features: number of columns of the data
+    :param max_elements: maximum number of elements of each chunk
+    :return: number of rows of each chunk
+    """
+    return max(1, max_elements // max(1, n_features))
 
 # ############# #
 #   Utilities   #
 # ############# #
 
 
+def rbm_free_energy(data, W, bh, bv):
+    """Free energy of binary-hidden RBM visible vectors, computed in numpy.
+
+    F(v) = - v.bv - sum_j log(1 + exp(v.W_j + bh_j))
+    :param data: array or scipy sparse matrix, visible vectors.
+        shape(n_samples, n_visible)
+    :param W: weights. shape(n_visible, n_hidden)
+    :param bh: hidden bias. shape(n_hidden,)
+    :param bv: visible bias. shape(n_visible,)
+    :return: free energies. shape(n_samples,)
+    """
+    # data.dot also accepts scipy sparse matrices
+    return -data.dot(bv) - np.logaddexp(0, data.dot(W) + bh).sum(axis=1)
+
+
+def rbm_ais_log_partition(W, bh, bv, betas=None, num_betas=1000,
+                          num_chains=100, base_data=None, rng=None):
+    """Estimate the log partition function of a binary RBM with AIS.
+
+    Annealed Importance Sampling (Salakhutdinov and Murray, 2008) from a
+    base RBM with no weights, whose log partition function is known, to
+    the given RBM. All the chains are run together as one batch, so each
+    intermediate distribution costs two matrix products.
+    :param W: weights. shape(n_visible, n_hidden)
+    :param bh: hidden bias. shape(n_hidden,)
+    :param bv: visible bias. shape(n_visible,)
+    :param betas: increasing inverse temperatures from 0 to 1, default
+        num_betas evenly spaced values
+    :param num_betas: number of inverse temperatures if betas is None
+    :param num_chains: number of AIS chains
+    :param base_data: optional, data used to set the visible bias of the
+        base RBM to the log odds of the mean of each feature, which
+        reduces the variance of the estimate. Default a zero visible bias
+    :param rng: random number generator (np.random.Generator or
+        np.random.RandomState), default the global numpy generator
+    :return: tuple(estimated log Z, log importance weights of the chains)
+    """
+    rng = np.random if rng is None else rng
+    if betas is None:
+        betas = np.linspace(0, 1, num_betas)
+    betas = np.asarray(betas, dtype=np.float64)
+
+    n_visible, n_hidden = W.shape
+    if base_data is None:
+        base_bv = np.zeros(n_visible)
+    else:
+        p = np.clip(np.mean(base_data, axis=0), 1e-3, 1 - 1e-3)
+        base_bv = np.log(p) - np.log(1 - p)
+
+    def log_unnorm_prob(v, beta):
+        # at beta = 0 the hidden units contribute the 2 ** n_hidden of log Z
+        # of the base rbm, at beta = 1 this is minus the free energy
+        return ((1 - beta) * np.dot(v, base_bv) + beta * np.dot(v, bv) +
+                np.logaddexp(0, beta * (np.dot(v, W) + bh)).sum(axis=1))
+
+    def sample_bernoulli(probs):
+        return (rng.random(probs.shape) < probs).astype(np.float64)
+
+    v = sample_bernoulli(np.tile(_sigmoid(base_bv), (num_chains, 1)))
+    log_w = np.zeros(num_chains)
+
+    for beta_prev, beta in zip(betas[:-1], betas[1:]):
+        log_w += log_unnorm_prob(v, beta) - log_unnorm_prob(v, beta_prev)
+
+        # gibbs step leaving the intermediate distribution invariant
+        h = sample_bernoulli(_sigmoid(beta * (np.dot(v, W) + bh)))
+        v = sample_bernoulli(_sigmoid(
+            (1 - beta) * base_bv + beta * (np.dot(h, W.T) + bv)))
+
+    log_z_base = np.logaddexp(0, base_bv).sum() + n_hidden * np.log(2)
+    max_w = log_w.max()
+    log_z = log_z_base + max_w + np.log(np.mean(np.exp(log_w - max_w)))
+
+    return log_z, log_w
+
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
 def expand_args(**args_to_expand):
     """Expand the given lists into the length of the layers.
 